@@ -1,23 +1,110 @@
-from flask import Flask, render_template, request, jsonify, session
+from flask import Flask, render_template, request, jsonify, session, Response, g, send_file, abort
 from flask_cors import CORS
 import os
+import time
+import threading
+from datetime import timedelta
 from dotenv import load_dotenv
-from openai import OpenAI
 import uuid
-from database import DatabaseManager
+from database import CONTEXT_WINDOW, DatabaseManager, window_messages
+from metrics import CHAT_STAGE_SECONDS, CHAT_ERRORS, record_token_usage, render_metrics
+from profiling import RequestProfiler
+from quotas import QuotaManager, estimate_tokens
+from routing import ModelRouter
 
 # Cargar variables de entorno
 load_dotenv()
 
 app = Flask(__name__)
-app.secret_key = os.urandom(24)  # Para manejar sesiones
+# Para manejar sesiones: con varios workers SECRET_KEY debe ser la misma en todos
+app.secret_key = os.getenv("SECRET_KEY") or os.urandom(24)
 CORS(app)
 
-# Configurar cliente OpenAI
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+# El nombre va en la cookie de sesión y es la clave de la cuota por usuario
+MAX_USER_NAME_LENGTH = 64
 
-# Inicializar base de datos
-db = DatabaseManager()
+# El cliente OpenAI y la base de datos se crean en el primer uso para que el
+# arranque y el fork de workers no paguen el import de openai ni las migraciones
+_client = None
+_db = None
+_quotas = None
+_router = None
+_init_lock = threading.Lock()
+
+def get_client():
+    """Cliente OpenAI compartido (creado en el primer uso)"""
+    global _client
+    if _client is None:
+        with _init_lock:
+            if _client is None:
+                if os.getenv("OPENAI_PROVIDER") == "mock":
+                    # Proveedor local para pruebas de carga y demos sin API key
+                    from mock_provider import MockOpenAIClient
+                    _client = MockOpenAIClient.from_env()
+                else:
+                    from openai import OpenAI
+                    _client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+    return _client
+
+def get_db() -> DatabaseManager:
+    """Base de datos compartida (CHATBOT_DB acepta una ruta o memory://<nombre>)"""
+    global _db
+    if _db is None:
+        with _init_lock:
+            if _db is None:
+                _db = DatabaseManager(os.getenv("CHATBOT_DB", "chatbot.db"))
+    return _db
+
+def get_quotas() -> QuotaManager:
+    """Cuotas de tokens en memoria (QUOTA_*), volcadas periódicamente a la base de datos"""
+    global _quotas
+    if _quotas is None:
+        db = get_db()
+        with _init_lock:
+            if _quotas is None:
+                _quotas = QuotaManager.from_env(db)
+                _quotas.start_background_flush()
+                _quotas.register_exit_flush()
+    return _quotas
+
+def get_router() -> ModelRouter:
+    """Enrutador de modelos (ROUTING_*) con estadísticas guardadas en la base de datos"""
+    global _router
+    if _router is None:
+        db = get_db()
+        with _init_lock:
+            if _router is None:
+                _router = ModelRouter.from_env(db)
+    return _router
+
+# Perfilado bajo demanda (PROFILE_ENABLED=1, cabecera X-Profile o PROFILE_SAMPLE_RATE)
+profiler = RequestProfiler.from_env()
+
+def is_admin() -> bool:
+    """Indica si la petición trae el token ADMIN_TOKEN"""
+    admin_token = os.getenv("ADMIN_TOKEN")
+    return bool(admin_token) and request.headers.get('X-Admin-Token') == admin_token
+
+def require_admin():
+    """Restringe los endpoints de administración al token ADMIN_TOKEN"""
+    if not is_admin():
+        abort(403)
+
+@app.before_request
+def start_profiling():
+    """Activa cProfile si la petición debe perfilarse (X-Profile solo con X-Admin-Token)"""
+    if request.endpoint != 'static' and profiler.should_profile(request.headers, is_admin()):
+        active = profiler.start()
+        if active is not None:
+            g.profile = active
+            g.profile_start = time.perf_counter()
+
+@app.teardown_request
+def stop_profiling(exc):
+    """Guarda el perfil de la petición en el buffer circular"""
+    active = g.pop('profile', None)
+    if active is not None:
+        profiler.stop(active, request.endpoint, time.perf_counter() - g.pop('profile_start'))
 
 @app.route('/')
 def home():
@@ -27,6 +114,7 @@ def home():
 @app.route('/chat', methods=['POST'])
 def chat():
     """Endpoint para procesar mensajes del chat"""
+    stage = 'parse'
     try:
         data = request.get_json()
         user_message = data.get('message', '').strip()
@@ -34,50 +122,109 @@ def chat():
         if not user_message:
             return jsonify({'error': 'Mensaje vacío'}), 400
         
-        # Obtener o crear ID de sesión
-        session_id = session.get('session_id')
-        if not session_id:
-            session_id = str(uuid.uuid4())
-            session['session_id'] = session_id
-            db.create_session(session_id)
+        # Solo texto acotado: se guarda en la cookie y otro tipo fallaría en cada petición
+        requested_name = data.get('user_name')
+        if requested_name is not None:
+            if not isinstance(requested_name, str) or not requested_name.strip() \
+                    or len(requested_name) > MAX_USER_NAME_LENGTH:
+                return jsonify({'error': f'user_name debe ser texto de 1 a {MAX_USER_NAME_LENGTH} caracteres'}), 400
+            requested_name = requested_name.strip()
         
-        # Guardar mensaje del usuario en la base de datos
-        db.add_message(session_id, 'user', user_message)
+        # Obtener o crear ID de sesión
+        stage = 'session'
+        with CHAT_STAGE_SECONDS.time(stage=stage):
+            session_id = session.get('session_id')
+            if not session_id:
+                session_id = str(uuid.uuid4())
+                session['session_id'] = session_id
+                # El nombre solo se acepta al crear la sesión (cookie firmada): la
+                # cuota por usuario es orientativa, no hay autenticación
+                session['user_name'] = requested_name
+                get_db().create_session(session_id, session['user_name'])
+            user_name = session.get('user_name')
         
         # Obtener historial de conversación desde la base de datos
-        messages = db.get_openai_messages(session_id)
+        stage = 'db_read'
+        with CHAT_STAGE_SECONDS.time(stage=stage):
+            messages = window_messages(
+                get_db().get_openai_messages(session_id) + [{'role': 'user', 'content': user_message}],
+                CONTEXT_WINDOW
+            )
+            # Profundidad real de la conversación (la ventana está acotada a CONTEXT_WINDOW)
+            depth = get_db().get_turn_count(session_id) + 1
+        
+        # Elegir modelo y max_tokens según el tipo de mensaje
+        stage = 'routing'
+        with CHAT_STAGE_SECONDS.time(stage=stage):
+            route = get_router().route(user_message, depth)
+        
+        # Comprobar cuotas en memoria antes de gastar tokens (el prompt también cuenta)
+        stage = 'quota'
+        with CHAT_STAGE_SECONDS.time(stage=stage):
+            quota = get_quotas().check(session_id, user_name, max_tokens=route['max_tokens'],
+                                       prompt_tokens=estimate_tokens(messages))
+        if not quota['allowed']:
+            response = jsonify({
+                'error': 'Límite de tokens alcanzado. Intenta de nuevo más tarde.',
+                'scope': quota['scope'],
+                'retry_after': int(quota['retry_after']) + 1
+            })
+            response.headers['Retry-After'] = str(int(quota['retry_after']) + 1)
+            return response, 429
+        
+        # Guardar mensaje del usuario en la base de datos
+        stage = 'db_write_user'
+        with CHAT_STAGE_SECONDS.time(stage=stage):
+            get_db().add_message(session_id, 'user', user_message)
         
         # Generar respuesta de OpenAI
-        response = client.chat.completions.create(
-            model="gpt-3.5-turbo",
-            messages=messages,
-            max_tokens=500,
-            temperature=0.7
-        )
+        stage = 'openai'
+        start_time = time.perf_counter()
+        with CHAT_STAGE_SECONDS.time(stage=stage):
+            response = get_client().chat.completions.create(
+                model=route['model'],
+                messages=messages,
+                max_tokens=quota['max_tokens'],
+                temperature=0.7
+            )
+        elapsed = time.perf_counter() - start_time
+        record_token_usage(getattr(response, 'usage', None), elapsed)
         
         ai_response = response.choices[0].message.content
         
         # Guardar respuesta de la IA en la base de datos
+        stage = 'db_write_assistant'
         tokens_used = response.usage.total_tokens if hasattr(response, 'usage') else 0
-        db.add_message(session_id, 'assistant', ai_response, tokens_used)
+        with CHAT_STAGE_SECONDS.time(stage=stage):
+            get_db().add_message(session_id, 'assistant', ai_response, tokens_used, latency=elapsed)
+        get_quotas().record(session_id, user_name, tokens_used)
+        get_router().record(route, elapsed, tokens_used)
         
         return jsonify({
             'response': ai_response,
             'session_id': session_id,
-            'tokens_used': tokens_used
+            'tokens_used': tokens_used,
+            'model': route['model'],
+            'quota_degraded': quota['degraded']
         })
     
     except Exception as e:
+        CHAT_ERRORS.inc(stage=stage)
         print(f"Error en chat: {e}")
         return jsonify({'error': f'Error interno: {str(e)}'}), 500
 
+@app.route('/metrics')
+def metrics():
+    """Métricas de latencia y tokens en formato Prometheus"""
+    return Response(render_metrics(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
 @app.route('/clear', methods=['POST'])
 def clear_conversation():
     """Limpiar la conversación actual"""
     try:
         session_id = session.get('session_id')
         if session_id:
-            success = db.clear_session(session_id)
+            success = get_db().clear_session(session_id)
             if success:
                 return jsonify({'message': 'Conversación limpiada exitosamente'})
             else:
@@ -89,19 +236,26 @@ def clear_conversation():
 
 @app.route('/history')
 def get_history():
-    """Obtener historial de la conversación (sin el mensaje del sistema)"""
+    """Obtener historial de la conversación (sin el mensaje del sistema)
+    
+    Devuelve los `limit` mensajes más recientes; con `before` (el `start` de la
+    página anterior) se pagina hacia atrás hasta el principio de la sesión.
+    """
     try:
+        limit = min(max(int(request.args.get('limit', 200)), 1), 1000)
+        before = int(request.args['before']) if 'before' in request.args else None
         session_id = session.get('session_id')
         if session_id:
-            history = db.get_conversation_history(session_id)
-            # Filtrar solo mensajes de usuario y asistente
-            filtered_history = [
+            page = get_db().get_history_page(session_id, limit, before)
+            history = [
                 {'role': msg['role'], 'content': msg['content'], 'timestamp': msg['timestamp']}
-                for msg in history if msg['role'] in ['user', 'assistant']
+                for msg in page['messages']
             ]
-            return jsonify({'history': filtered_history})
+            return jsonify({'history': history, 'start': page['start'], 'total': page['total']})
         else:
-            return jsonify({'history': []})
+            return jsonify({'history': [], 'start': 0, 'total': 0})
+    except ValueError as e:
+        return jsonify({'error': f'Parámetros no válidos: {str(e)}'}), 400
     except Exception as e:
         return jsonify({'error': f'Error: {str(e)}'}), 500
 
@@ -111,27 +265,77 @@ def get_stats():
     try:
         session_id = session.get('session_id')
         if session_id:
-            stats = db.get_session_stats(session_id)
+            stats = get_db().get_session_stats(session_id)
             return jsonify(stats)
         else:
             return jsonify({'message': 'No hay sesión activa'})
     except Exception as e:
         return jsonify({'error': f'Error: {str(e)}'}), 500
 
+@app.route('/admin/profiles')
+def list_profiles():
+    """Listar los perfiles de peticiones guardados"""
+    require_admin()
+    return jsonify({'profiles': profiler.list_profiles()})
+
+@app.route('/admin/profiles/<name>')
+def download_profile(name):
+    """Descargar un perfil (.prof de cProfile o resumen con ?format=text)"""
+    require_admin()
+    if request.args.get('format') == 'text':
+        text = profiler.render_text(name)
+        if text is None:
+            abort(404)
+        return Response(text, mimetype='text/plain; charset=utf-8')
+    
+    path = profiler.profile_path(name)
+    if not path:
+        abort(404)
+    return send_file(os.path.abspath(path), as_attachment=True, download_name=name)
+
+@app.route('/admin/routes')
+def list_routes():
+    """Tabla de enrutado de modelos con latencia y coste observados"""
+    require_admin()
+    return jsonify({'routes': get_router().get_table()})
+
 @app.route('/sessions')
 def get_sessions():
     """Obtener todas las sesiones"""
     try:
-        sessions = db.get_all_sessions()
+        sessions = get_db().get_all_sessions()
         return jsonify({'sessions': sessions})
     except Exception as e:
         return jsonify({'error': f'Error: {str(e)}'}), 500
 
+@app.route('/usage')
+def get_usage_series():
+    """Uso agregado (mensajes, tokens, sesiones activas, latencia) desde los rollups"""
+    try:
+        # numpy solo se importa al consultar el uso, no en el arranque
+        from usage import MAX_POINTS, get_usage, parse_utc, utc_now
+        
+        # Todo se normaliza a UTC sin zona para poder comparar start y end
+        end = parse_utc(request.args['end']) if 'end' in request.args else utc_now()
+        start = parse_utc(request.args['start']) if 'start' in request.args else end - timedelta(hours=24)
+        period = request.args.get('period')
+        if period not in (None, 'hourly', 'daily'):
+            return jsonify({'error': 'period debe ser hourly o daily'}), 400
+        if start >= end:
+            return jsonify({'error': 'start debe ser anterior a end'}), 400
+        max_points = min(max(int(request.args.get('points', 200)), 1), MAX_POINTS)
+        
+        return jsonify(get_usage(get_db(), start, end, period, max_points))
+    except ValueError as e:
+        return jsonify({'error': f'Parámetros no válidos: {str(e)}'}), 400
+    except Exception as e:
+        return jsonify({'error': f'Error: {str(e)}'}), 500
+
 @app.route('/backup', methods=['POST'])
 def create_backup():
     """Crear backup de la base de datos"""
     try:
-        success = db.backup_database()
+        success = get_db().backup_database()
         if success:
             return jsonify({'message': 'Backup creado exitosamente'})
         else:
@@ -142,5 +346,7 @@ def create_backup():
 if __name__ == '__main__':
     print("🌐 Iniciando servidor web del chatbot...")
     print("📱 Accede a: http://localhost:5000")
+    print("🏭 Producción: gunicorn -c gunicorn.conf.py app:app")
+    get_db()
     print("💾 Base de datos SQLite inicializada")
     app.run(debug=True, host='0.0.0.0', port=5000)
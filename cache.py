@@ -0,0 +1,186 @@
+"""
+Cachés del chatbot con opción compartida entre procesos
+- local: diccionario LRU con TTL dentro del proceso (un worker)
+- sqlite: tabla en un archivo SQLite compartido por todos los workers
+- tiered: local delante de sqlite, para no pagar SQLite en cada acierto
+Se elige con CACHE_BACKEND (local por defecto) y CACHE_DB para el archivo compartido
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+_MISSING = object()
+
+# Archivos cuyo esquema ya se creó en este proceso: crear una caché no repite el DDL
+_initialized_paths = set()
+_initialized_lock = threading.Lock()
+
+
+class LocalCache:
+    """Caché LRU con expiración dentro del proceso"""
+
+    def __init__(self, max_entries: int = 10000, ttl: float = None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str, default=None):
+        with self._lock:
+            entry = self._entries.get(key, _MISSING)
+            if entry is _MISSING:
+                return default
+            value, expires_at = entry
+            if expires_at is not None and expires_at < time.monotonic():
+                del self._entries[key]
+                return default
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value, ttl: float = None):
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = time.monotonic() + ttl if ttl else None
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key: str):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class SQLiteCache:
+    """Caché compartida entre procesos en un archivo SQLite (valores JSON)"""
+
+    def __init__(self, path: str = "cache.db", namespace: str = "default", ttl: float = None):
+        self.path = path
+        self.namespace = namespace
+        self.ttl = ttl
+        self._ensure_schema()
+
+    def _ensure_schema(self):
+        """Crea la tabla una sola vez por proceso y archivo"""
+        key = os.path.abspath(self.path)
+        with _initialized_lock:
+            if key in _initialized_paths:
+                return
+            self._create_schema()
+            _initialized_paths.add(key)
+
+    def _create_schema(self):
+        conn = self._connect()
+        try:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS cache_entries (
+                    namespace TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    value TEXT NOT NULL,
+                    expires_at REAL,
+                    PRIMARY KEY (namespace, key)
+                )
+            ''')
+            conn.commit()
+        finally:
+            conn.close()
+
+    def _connect(self) -> sqlite3.Connection:
+        # Conexión por operación: segura tras el fork de los workers
+        return sqlite3.connect(self.path, timeout=5)
+
+    def _execute(self, sql: str, parameters=()):
+        """Ejecuta una sentencia y hace commit; devuelve la primera fila si la hay"""
+        for attempt in range(2):
+            conn = self._connect()
+            try:
+                row = conn.execute(sql, parameters).fetchone()
+                conn.commit()
+                return row
+            except sqlite3.OperationalError as e:
+                # El archivo se borró después de crear el esquema en este proceso
+                if attempt or "no such table" not in str(e):
+                    raise
+            finally:
+                conn.close()
+            self._create_schema()
+
+    def get(self, key: str, default=None):
+        row = self._execute('''
+            SELECT value, expires_at FROM cache_entries
+            WHERE namespace = ? AND key = ?
+        ''', (self.namespace, key))
+        if not row or (row[1] is not None and row[1] < time.time()):
+            return default
+        return json.loads(row[0])
+
+    def set(self, key: str, value, ttl: float = None):
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = time.time() + ttl if ttl else None
+        self._execute('''
+            INSERT OR REPLACE INTO cache_entries (namespace, key, value, expires_at)
+            VALUES (?, ?, ?, ?)
+        ''', (self.namespace, key, json.dumps(value), expires_at))
+
+    def delete(self, key: str):
+        self._execute('DELETE FROM cache_entries WHERE namespace = ? AND key = ?',
+                      (self.namespace, key))
+
+    def clear(self):
+        self._execute('DELETE FROM cache_entries WHERE namespace = ?', (self.namespace,))
+
+
+class TieredCache:
+    """Caché local de vida corta delante de la caché compartida"""
+
+    def __init__(self, shared: SQLiteCache, local_ttl: float = 5, max_entries: int = 10000):
+        self.shared = shared
+        self.local = LocalCache(max_entries=max_entries, ttl=local_ttl)
+
+    def get(self, key: str, default=None):
+        value = self.local.get(key, _MISSING)
+        if value is not _MISSING:
+            return value
+        value = self.shared.get(key, _MISSING)
+        if value is _MISSING:
+            return default
+        self.local.set(key, value)
+        return value
+
+    def set(self, key: str, value, ttl: float = None):
+        self.shared.set(key, value, ttl)
+        self.local.set(key, value)
+
+    def delete(self, key: str):
+        self.shared.delete(key)
+        self.local.delete(key)
+
+    def clear(self):
+        self.shared.clear()
+        self.local.clear()
+
+
+def create_cache(namespace: str, ttl: float = None, max_entries: int = 10000):
+    """Crea la caché configurada por CACHE_BACKEND para un espacio de nombres"""
+    backend = os.getenv("CACHE_BACKEND", "local").lower()
+    if backend == "local":
+        return LocalCache(max_entries=max_entries, ttl=ttl)
+
+    shared = SQLiteCache(os.getenv("CACHE_DB", "cache.db"), namespace, ttl)
+    if backend == "sqlite":
+        return shared
+    if backend == "tiered":
+        local_ttl = float(os.getenv("CACHE_LOCAL_TTL", "5"))
+        if ttl:
+            local_ttl = min(local_ttl, ttl)
+        return TieredCache(shared, local_ttl=local_ttl, max_entries=max_entries)
+    raise ValueError(f"CACHE_BACKEND no soportado: {backend}")
@@ -6,8 +6,20 @@ Permite eliminar información guardada de forma selectiva
 
 import os
 import sys
+import time
 from database import DatabaseManager
 from datetime import datetime
+from dotenv import load_dotenv
+from storage import SQLiteFileEngine, create_engine
+
+load_dotenv()
+
+# Misma base de datos que la aplicación (ruta o memory://<nombre>)
+DB_TARGET = os.getenv("CHATBOT_DB", "chatbot.db")
+
+def database_exists() -> bool:
+    """Indica si la base de datos configurada existe (archivo o motor en memoria)"""
+    return create_engine(DB_TARGET).exists()
 
 def show_menu():
     """Muestra el menú de opciones"""
@@ -18,7 +30,9 @@ def show_menu():
     print("3. 📊 Ver estadísticas actuales")
     print("4. 💾 Crear backup antes de limpiar")
     print("5. 🔄 Resetear solo mi sesión actual")
-    print("6. ❌ Salir")
+    print("6. 🧊 Archivar sesiones inactivas (comprimir)")
+    print("7. 📉 Compactar rollups de uso")
+    print("8. ❌ Salir")
     print("-" * 40)
 
 def clear_all_database():
@@ -26,12 +40,17 @@ def clear_all_database():
     confirm = input("⚠️  ¿Estás SEGURO de que quieres eliminar TODA la información? (escribe 'SÍ ELIMINAR'): ")
     if confirm == "SÍ ELIMINAR":
         try:
-            if os.path.exists("chatbot.db"):
-                os.remove("chatbot.db")
+            engine = create_engine(DB_TARGET)
+            if engine.exists():
+                if isinstance(engine, SQLiteFileEngine):
+                    os.remove(engine.path)
+                else:
+                    # Cerrar el motor en memoria descarta sus datos
+                    engine.close()
                 print("✅ Base de datos eliminada completamente")
                 
                 # Crear nueva base de datos limpia
-                db = DatabaseManager()
+                db = DatabaseManager(DB_TARGET)
                 print("✅ Nueva base de datos inicializada")
             else:
                 print("ℹ️  No hay base de datos para eliminar")
@@ -43,11 +62,11 @@ def clear_all_database():
 def show_current_stats():
     """Muestra estadísticas actuales de la base de datos"""
     try:
-        if not os.path.exists("chatbot.db"):
+        if not database_exists():
             print("ℹ️  No hay base de datos existente")
             return
             
-        db = DatabaseManager()
+        db = DatabaseManager(DB_TARGET)
         sessions = db.get_all_sessions()
         
         print("\n📊 ESTADÍSTICAS ACTUALES:")
@@ -76,11 +95,11 @@ def show_current_stats():
 def create_backup():
     """Crea un backup antes de limpiar"""
     try:
-        if not os.path.exists("chatbot.db"):
+        if not database_exists():
             print("ℹ️  No hay base de datos para respaldar")
             return False
             
-        db = DatabaseManager()
+        db = DatabaseManager(DB_TARGET)
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
         backup_name = f"backup_before_cleanup_{timestamp}.db"
         
@@ -98,11 +117,11 @@ def create_backup():
 def clear_specific_sessions():
     """Permite limpiar sesiones específicas"""
     try:
-        if not os.path.exists("chatbot.db"):
+        if not database_exists():
             print("ℹ️  No hay base de datos existente")
             return
             
-        db = DatabaseManager()
+        db = DatabaseManager(DB_TARGET)
         sessions = db.get_all_sessions()
         
         if not sessions:
@@ -155,13 +174,84 @@ def reset_current_session():
     print("3. O cierra y abre una nueva pestaña/ventana")
     print("\nEsto creará una nueva sesión limpia manteniendo el historial anterior.")
 
+def archive_idle_sessions():
+    """Comprime las sesiones inactivas y reporta ahorro y latencia de lectura"""
+    try:
+        if not database_exists():
+            print("ℹ️  No hay base de datos existente")
+            return
+        
+        try:
+            idle_days = int(input("Días de inactividad para archivar (30): ") or 30)
+        except ValueError:
+            print("❌ Por favor ingresa un número válido")
+            return
+        
+        codec = input("Códec (zlib/zstd) [zlib]: ").strip() or "zlib"
+        use_dictionary = input("¿Usar diccionario compartido? (s/N): ").lower() in ['s', 'si', 'sí']
+        
+        db = DatabaseManager(DB_TARGET)
+        dictionary = db.build_archive_dictionary() if use_dictionary else None
+        result = db.archive_idle_sessions(idle_days, codec, dictionary)
+        
+        if not result:
+            print("❌ Error al archivar sesiones")
+            return
+        
+        print(f"\n🧊 Sesiones archivadas: {result['sessions']}")
+        print(f"   Mensajes movidos: {result['messages']}")
+        print(f"   Tamaño original: {result['raw_bytes']} bytes")
+        print(f"   Tamaño comprimido: {result['compressed_bytes']} bytes")
+        print(f"   Ahorro: {result['saved_bytes']} bytes")
+        
+        # Medir la latencia de lectura de las sesiones archivadas
+        if result['session_ids']:
+            latencies = []
+            for session_id in result['session_ids']:
+                start_time = time.perf_counter()
+                db.get_conversation_history(session_id)
+                latencies.append((time.perf_counter() - start_time) * 1000)
+            latencies.sort()
+            print(f"   Lectura archivada: media {sum(latencies) / len(latencies):.2f} ms, "
+                  f"máx {latencies[-1]:.2f} ms")
+        
+        totals = db.get_archive_stats()
+        if totals:
+            print(f"\n📦 Archivo total: {totals['archived_sessions']} sesiones, "
+                  f"{totals['saved_bytes']} bytes ahorrados "
+                  f"(ratio {totals['ratio']:.2f})")
+    
+    except Exception as e:
+        print(f"❌ Error al archivar: {e}")
+
+def compact_usage_rollups():
+    """Poda las tablas auxiliares de los rollups y los rollups horarios antiguos"""
+    try:
+        if not database_exists():
+            print("ℹ️  No hay base de datos existente")
+            return
+        
+        try:
+            retention = int(input("Días de rollups horarios a conservar (90): ") or 90)
+        except ValueError:
+            print("❌ Por favor ingresa un número válido")
+            return
+        
+        db = DatabaseManager(DB_TARGET)
+        if db.compact_usage_rollups(retention):
+            print("✅ Rollups de uso compactados")
+        else:
+            print("❌ Error al compactar rollups")
+    except Exception as e:
+        print(f"❌ Error al compactar: {e}")
+
 def main():
     """Función principal"""
     while True:
         show_menu()
         
         try:
-            choice = input("Selecciona una opción (1-6): ").strip()
+            choice = input("Selecciona una opción (1-8): ").strip()
             
             if choice == "1":
                 clear_all_database()
@@ -174,10 +264,14 @@ def main():
             elif choice == "5":
                 reset_current_session()
             elif choice == "6":
+                archive_idle_sessions()
+            elif choice == "7":
+                compact_usage_rollups()
+            elif choice == "8":
                 print("👋 ¡Hasta luego!")
                 break
             else:
-                print("❌ Opción no válida. Por favor selecciona 1-6.")
+                print("❌ Opción no válida. Por favor selecciona 1-8.")
                 
         except KeyboardInterrupt:
             print("\n\n👋 Operación cancelada por el usuario")
@@ -1,80 +1,89 @@
 import sqlite3
 import json
+import bisect
 import os
+import zlib
 from datetime import datetime
 from typing import List, Dict, Optional
 
+from metrics import timed_method
+from storage import create_engine
+from migrations import apply_migrations
+from cache import create_cache
+
+try:
+    import zstandard
+except ImportError:  # zstd es opcional, zlib siempre está disponible
+    zstandard = None
+
+# Prompt del sistema por defecto (se guarda una sola vez en prompt_templates)
+DEFAULT_SYSTEM_PROMPT = "Eres un asistente relajado y divertido. Responde de manera amigable y útil."
+
+# Máximo de mensajes de la conversación (sin contar el del sistema) enviados a OpenAI
+CONTEXT_WINDOW = 20
+
+def window_messages(messages: List[Dict], limit: int = CONTEXT_WINDOW) -> List[Dict]:
+    """Ventana de contexto: todos los mensajes del sistema y los últimos `limit` del resto"""
+    system = [msg for msg in messages if msg['role'] == 'system']
+    conversation = [msg for msg in messages if msg['role'] != 'system']
+    return system + conversation[-limit:] if limit > 0 else system
+
+# Periodos de los rollups de uso y su formato de inicio de bucket (UTC)
+ROLLUP_PERIODS = {
+    'hourly': '%Y-%m-%d %H:00:00',
+    'daily': '%Y-%m-%d 00:00:00'
+}
+
+# Límites superiores (segundos) de los buckets de latencia de los rollups
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 0.75, 1.0, 1.5, 2.0, 3.0, 4.0, 6.0, 8.0, 12.0, 16.0, 24.0, 32.0, 60.0)
+
+def latency_bucket(latency: float) -> int:
+    """Índice del bucket de latencia (len(LATENCY_BUCKETS) para el desbordamiento)"""
+    return bisect.bisect_left(LATENCY_BUCKETS, latency)
+
 class DatabaseManager:
     """Manejador de base de datos SQLite para el chatbot"""
     
-    def __init__(self, db_path: str = "chatbot.db"):
-        self.db_path = db_path
+    def __init__(self, db_path="chatbot.db"):
+        # db_path puede ser una ruta, ':memory:', 'memory://<nombre>' o un StorageEngine
+        self.engine = create_engine(db_path)
+        self.db_path = db_path if isinstance(db_path, str) else self.engine.name
+        # Las plantillas son inmutables por id; el espacio de nombres identifica la
+        # base de datos (ruta absoluta o instancia en memoria) porque los ids solo
+        # son únicos dentro de cada una
+        self._prompt_cache = create_cache(f"prompts:{self.engine.identity}", max_entries=1000)
+        self._prompt_ids = {}
         self.init_database()
     
+    def _connect(self) -> sqlite3.Connection:
+        """Abre una conexión instrumentada del motor (commits y bloqueos van a /metrics)"""
+        return self.engine.connect()
+    
     def init_database(self):
-        """Inicializa la base de datos y crea las tablas necesarias"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        # Tabla para sesiones de usuario
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS sessions (
-                id TEXT PRIMARY KEY,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                last_activity TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                user_name TEXT,
-                session_data TEXT
-            )
-        ''')
-        
-        # Tabla para mensajes de conversación
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS messages (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                session_id TEXT,
-                role TEXT CHECK(role IN ('system', 'user', 'assistant')),
-                content TEXT NOT NULL,
-                timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                tokens_used INTEGER DEFAULT 0,
-                FOREIGN KEY (session_id) REFERENCES sessions (id)
-            )
-        ''')
-        
-        # Tabla para configuraciones
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS settings (
-                key TEXT PRIMARY KEY,
-                value TEXT,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        # Índices para mejorar performance
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_messages_session ON messages(session_id)')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_messages_timestamp ON messages(timestamp)')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_sessions_activity ON sessions(last_activity)')
-        
-        conn.commit()
-        conn.close()
+        """Aplica las migraciones pendientes; no ejecuta DDL si el esquema está al día"""
+        conn = self._connect()
+        try:
+            applied = apply_migrations(conn)
+        finally:
+            conn.close()
         
-        print(f"✅ Base de datos inicializada: {self.db_path}")
+        if applied:
+            print(f"✅ Base de datos inicializada: {self.db_path} (esquema v{applied[-1]})")
     
-    def create_session(self, session_id: str, user_name: str = None) -> bool:
-        """Crea una nueva sesión de usuario"""
+    @timed_method
+    def create_session(self, session_id: str, user_name: str = None,
+                       system_prompt: str = DEFAULT_SYSTEM_PROMPT) -> bool:
+        """Crea una nueva sesión de usuario que referencia su plantilla de prompt"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
+            template_id = self.get_prompt_template_id(system_prompt)
             
-            cursor.execute('''
-                INSERT OR REPLACE INTO sessions (id, user_name, created_at, last_activity)
-                VALUES (?, ?, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP)
-            ''', (session_id, user_name))
+            conn = self._connect()
+            cursor = conn.cursor()
             
-            # Agregar mensaje del sistema
             cursor.execute('''
-                INSERT INTO messages (session_id, role, content)
-                VALUES (?, 'system', 'Eres un asistente relajado y divertido. Responde de manera amigable y útil.')
-            ''', (session_id,))
+                INSERT OR REPLACE INTO sessions (id, user_name, created_at, last_activity, prompt_template_id)
+                VALUES (?, ?, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP, ?)
+            ''', (session_id, user_name, template_id))
             
             conn.commit()
             conn.close()
@@ -83,10 +92,68 @@ class DatabaseManager:
             print(f"Error al crear sesión: {e}")
             return False
     
-    def add_message(self, session_id: str, role: str, content: str, tokens_used: int = 0) -> bool:
+    @timed_method
+    def get_prompt_template_id(self, content: str, name: str = "default") -> int:
+        """Devuelve el id de la plantilla con ese contenido, creando una nueva versión si no existe"""
+        template_id = self._prompt_ids.get(content)
+        if template_id is not None:
+            return template_id
+        
+        conn = self._connect()
+        try:
+            cursor = conn.cursor()
+            cursor.execute('SELECT id FROM prompt_templates WHERE content = ?', (content,))
+            row = cursor.fetchone()
+            if row:
+                template_id = row[0]
+            else:
+                cursor.execute('''
+                    INSERT INTO prompt_templates (name, version, content)
+                    SELECT ?, COALESCE(MAX(version), 0) + 1, ?
+                    FROM prompt_templates
+                    WHERE name = ?
+                ''', (name, content, name))
+                template_id = cursor.lastrowid
+                conn.commit()
+        finally:
+            conn.close()
+        
+        self._prompt_ids[content] = template_id
+        self._prompt_cache.set(str(template_id), content)
+        return template_id
+    
+    def _resolve_prompt_template(self, cursor, template_id: int) -> Optional[str]:
+        """Resuelve el contenido de una plantilla desde la caché (CACHE_BACKEND)"""
+        content = self._prompt_cache.get(str(template_id))
+        if content is None:
+            cursor.execute('SELECT content FROM prompt_templates WHERE id = ?', (template_id,))
+            row = cursor.fetchone()
+            if not row:
+                return None
+            content = row[0]
+            self._prompt_cache.set(str(template_id), content)
+        return content
+    
+    def _session_system_messages(self, cursor, session_id: str) -> List[Dict]:
+        """Mensaje del sistema de la sesión a partir de su plantilla"""
+        cursor.execute('''
+            SELECT prompt_template_id, created_at FROM sessions WHERE id = ?
+        ''', (session_id,))
+        
+        row = cursor.fetchone()
+        if not row or row[0] is None:
+            return []
+        content = self._resolve_prompt_template(cursor, row[0])
+        if content is None:
+            return []
+        return [{'role': 'system', 'content': content, 'timestamp': row[1], 'tokens_used': 0}]
+    
+    @timed_method
+    def add_message(self, session_id: str, role: str, content: str, tokens_used: int = 0,
+                    latency: float = None) -> bool:
         """Agrega un mensaje a la conversación"""
         try:
-            conn = sqlite3.connect(self.db_path)
+            conn = self._connect()
             cursor = conn.cursor()
             
             # Verificar que la sesión existe
@@ -94,6 +161,9 @@ class DatabaseManager:
             if not cursor.fetchone():
                 self.create_session(session_id)
             
+            # Una sesión archivada que se reanuda vuelve a la tabla activa
+            self._restore_archived_session(cursor, session_id)
+            
             # Agregar mensaje
             cursor.execute('''
                 INSERT INTO messages (session_id, role, content, tokens_used)
@@ -106,6 +176,10 @@ class DatabaseManager:
                 WHERE id = ?
             ''', (session_id,))
             
+            # Mantener los rollups de uso en la misma transacción
+            if role in ('user', 'assistant'):
+                self._update_usage_rollups(cursor, session_id, role, tokens_used, latency)
+            
             conn.commit()
             conn.close()
             return True
@@ -113,21 +187,127 @@ class DatabaseManager:
             print(f"Error al agregar mensaje: {e}")
             return False
     
+    def _update_usage_rollups(self, cursor, session_id: str, role: str, tokens_used: int,
+                              latency: float = None):
+        """Suma el mensaje a los rollups por hora y por día"""
+        for period, bucket_format in ROLLUP_PERIODS.items():
+            # Sesión activa nueva en el bucket solo si no estaba ya registrada
+            cursor.execute(f'''
+                INSERT OR IGNORE INTO usage_{period}_sessions (bucket_start, session_id)
+                VALUES (strftime(?, 'now'), ?)
+            ''', (bucket_format, session_id))
+            new_session = 1 if cursor.rowcount == 1 else 0
+            
+            cursor.execute(f'''
+                INSERT INTO usage_{period}
+                    (bucket_start, messages, user_messages, assistant_messages, tokens,
+                     active_sessions, latency_count, latency_sum)
+                VALUES (strftime(?, 'now'), 1, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (bucket_start) DO UPDATE SET
+                    messages = messages + 1,
+                    user_messages = user_messages + excluded.user_messages,
+                    assistant_messages = assistant_messages + excluded.assistant_messages,
+                    tokens = tokens + excluded.tokens,
+                    active_sessions = active_sessions + excluded.active_sessions,
+                    latency_count = latency_count + excluded.latency_count,
+                    latency_sum = latency_sum + excluded.latency_sum
+            ''', (
+                bucket_format,
+                1 if role == 'user' else 0,
+                1 if role == 'assistant' else 0,
+                tokens_used or 0,
+                new_session,
+                0 if latency is None else 1,
+                latency or 0
+            ))
+            
+            if latency is not None:
+                cursor.execute(f'''
+                    INSERT INTO usage_latency_{period} (bucket_start, latency_bucket, count)
+                    VALUES (strftime(?, 'now'), ?, 1)
+                    ON CONFLICT (bucket_start, latency_bucket) DO UPDATE SET count = count + 1
+                ''', (bucket_format, latency_bucket(latency)))
+    
+    @timed_method
+    def get_usage_rollups(self, period: str, start: str, end: str) -> Dict:
+        """Obtiene los rollups de un periodo ('hourly' o 'daily') en [start, end)"""
+        try:
+            if period not in ROLLUP_PERIODS:
+                raise ValueError(f"Periodo no soportado: {period}")
+            
+            conn = self._connect()
+            cursor = conn.cursor()
+            
+            cursor.execute(f'''
+                SELECT bucket_start, messages, user_messages, assistant_messages, tokens,
+                       active_sessions, latency_count, latency_sum
+                FROM usage_{period}
+                WHERE bucket_start >= ? AND bucket_start < ?
+                ORDER BY bucket_start
+            ''', (start, end))
+            rows = cursor.fetchall()
+            
+            cursor.execute(f'''
+                SELECT bucket_start, latency_bucket, count
+                FROM usage_latency_{period}
+                WHERE bucket_start >= ? AND bucket_start < ?
+            ''', (start, end))
+            latency_rows = cursor.fetchall()
+            
+            conn.close()
+            return {'rows': rows, 'latency_rows': latency_rows}
+        except Exception as e:
+            print(f"Error al obtener rollups de uso: {e}")
+            return {'rows': [], 'latency_rows': []}
+    
+    @timed_method
+    def compact_usage_rollups(self, hourly_retention_days: int = 90) -> bool:
+        """Compactador: poda las tablas auxiliares de sesiones y los rollups horarios antiguos"""
+        try:
+            conn = self._connect()
+            cursor = conn.cursor()
+            
+            # Solo el bucket en curso necesita deduplicar sesiones activas
+            for period, bucket_format in ROLLUP_PERIODS.items():
+                cursor.execute(f'''
+                    DELETE FROM usage_{period}_sessions
+                    WHERE bucket_start < strftime(?, 'now')
+                ''', (bucket_format,))
+            
+            # Los rollups diarios se conservan; los horarios solo durante la retención
+            for table in ('usage_hourly', 'usage_latency_hourly'):
+                cursor.execute(f'''
+                    DELETE FROM {table}
+                    WHERE bucket_start < strftime('%Y-%m-%d %H:00:00', 'now', ?)
+                ''', (f'-{int(hourly_retention_days)} days',))
+            
+            conn.commit()
+            conn.close()
+            return True
+        except Exception as e:
+            print(f"Error al compactar rollups de uso: {e}")
+            return False
+    
+    @timed_method
     def get_conversation_history(self, session_id: str, limit: int = 50) -> List[Dict]:
         """Obtiene el historial de conversación de una sesión"""
         try:
-            conn = sqlite3.connect(self.db_path)
+            conn = self._connect()
             cursor = conn.cursor()
             
+            # Prompt de la plantilla, mensajes archivados (más antiguos) y luego los activos
+            messages = self._session_system_messages(cursor, session_id)
+            messages.extend(self._load_archived_messages(cursor, session_id))
+            messages = messages[:limit]
+            
             cursor.execute('''
                 SELECT role, content, timestamp, tokens_used
                 FROM messages
                 WHERE session_id = ?
                 ORDER BY timestamp ASC
                 LIMIT ?
-            ''', (session_id, limit))
+            ''', (session_id, limit - len(messages)))
             
-            messages = []
             for row in cursor.fetchall():
                 messages.append({
                     'role': row[0],
@@ -142,39 +322,111 @@ class DatabaseManager:
             print(f"Error al obtener historial: {e}")
             return []
     
-    def get_openai_messages(self, session_id: str, limit: int = 20) -> List[Dict]:
-        """Obtiene mensajes en formato OpenAI para la API"""
+    @timed_method
+    def get_history_page(self, session_id: str, limit: int = 200, before: int = None) -> Dict:
+        """Página de la conversación (usuario y asistente) que termina antes de la posición `before`
+        
+        Las posiciones son el orden cronológico desde el primer mensaje (archivados
+        incluidos); sin `before` se devuelven los `limit` más recientes.
+        """
         try:
-            conn = sqlite3.connect(self.db_path)
+            conn = self._connect()
             cursor = conn.cursor()
             
+            archived = [
+                msg for msg in self._load_archived_messages(cursor, session_id)
+                if msg['role'] in ('user', 'assistant')
+            ]
             cursor.execute('''
-                SELECT role, content
-                FROM messages
-                WHERE session_id = ? AND role IN ('system', 'user', 'assistant')
-                ORDER BY timestamp ASC
-                LIMIT ?
-            ''', (session_id, limit))
+                SELECT COUNT(*) FROM messages
+                WHERE session_id = ? AND role IN ('user', 'assistant')
+            ''', (session_id,))
+            total = len(archived) + cursor.fetchone()[0]
             
-            messages = []
-            for row in cursor.fetchall():
-                messages.append({
-                    'role': row[0],
-                    'content': row[1]
-                })
+            end = total if before is None else max(min(before, total), 0)
+            start = max(end - limit, 0)
+            
+            messages = archived[start:end]
+            live_start = max(start - len(archived), 0)
+            live_end = end - len(archived)
+            if live_end > live_start:
+                cursor.execute('''
+                    SELECT role, content, timestamp, tokens_used
+                    FROM messages
+                    WHERE session_id = ? AND role IN ('user', 'assistant')
+                    ORDER BY id ASC
+                    LIMIT ? OFFSET ?
+                ''', (session_id, live_end - live_start, live_start))
+                messages.extend(
+                    {'role': row[0], 'content': row[1], 'timestamp': row[2], 'tokens_used': row[3]}
+                    for row in cursor.fetchall()
+                )
             
             conn.close()
-            return messages
+            return {'messages': messages, 'start': start, 'total': total}
+        except Exception as e:
+            print(f"Error al obtener página del historial: {e}")
+            return {'messages': [], 'start': 0, 'total': 0}
+    
+    @timed_method
+    def get_openai_messages(self, session_id: str, limit: int = CONTEXT_WINDOW) -> List[Dict]:
+        """Obtiene mensajes en formato OpenAI para la API (ventana de contexto acotada)"""
+        try:
+            conn = self._connect()
+            cursor = conn.cursor()
+            
+            messages = [
+                {'role': msg['role'], 'content': msg['content']}
+                for msg in self._session_system_messages(cursor, session_id)
+            ]
+            
+            # Mensajes del sistema más los últimos `limit` de la conversación
+            cursor.execute('''
+                SELECT role, content FROM (
+                    SELECT id, role, content FROM messages
+                    WHERE session_id = ? AND role = 'system'
+                    UNION ALL
+                    SELECT * FROM (
+                        SELECT id, role, content FROM messages
+                        WHERE session_id = ? AND role IN ('user', 'assistant')
+                        ORDER BY id DESC
+                        LIMIT ?
+                    )
+                )
+                ORDER BY id ASC
+            ''', (session_id, session_id, limit))
+            live = [{'role': row[0], 'content': row[1]} for row in cursor.fetchall()]
+            
+            # El bloque archivado solo se descomprime si los activos no llenan la ventana
+            if sum(1 for msg in live if msg['role'] != 'system') < limit:
+                messages.extend(
+                    {'role': msg['role'], 'content': msg['content']}
+                    for msg in self._load_archived_messages(cursor, session_id)
+                )
+            messages.extend(live)
+            
+            conn.close()
+            return window_messages(messages, limit)
         except Exception as e:
             print(f"Error al obtener mensajes OpenAI: {e}")
-            return [{"role": "system", "content": "Eres un asistente relajado y divertido."}]
+            return [{"role": "system", "content": DEFAULT_SYSTEM_PROMPT}]
     
+    @timed_method
     def clear_session(self, session_id: str) -> bool:
         """Limpia todas las conversaciones de una sesión (excepto el mensaje del sistema)"""
         try:
-            conn = sqlite3.connect(self.db_path)
+            conn = self._connect()
             cursor = conn.cursor()
             
+            # Si la sesión está archivada, recuperar su mensaje del sistema
+            for msg in self._load_archived_messages(cursor, session_id):
+                if msg['role'] == 'system':
+                    cursor.execute('''
+                        INSERT INTO messages (session_id, role, content, timestamp, tokens_used)
+                        VALUES (?, ?, ?, ?, ?)
+                    ''', (session_id, msg['role'], msg['content'], msg['timestamp'], msg['tokens_used']))
+            cursor.execute('DELETE FROM archived_sessions WHERE session_id = ?', (session_id,))
+            
             # Eliminar todos los mensajes excepto el del sistema
             cursor.execute('''
                 DELETE FROM messages
@@ -194,10 +446,11 @@ class DatabaseManager:
             print(f"Error al limpiar sesión: {e}")
             return False
     
+    @timed_method
     def get_session_stats(self, session_id: str) -> Dict:
         """Obtiene estadísticas de una sesión"""
         try:
-            conn = sqlite3.connect(self.db_path)
+            conn = self._connect()
             cursor = conn.cursor()
             
             # Contar mensajes
@@ -213,6 +466,17 @@ class DatabaseManager:
             
             stats = cursor.fetchone()
             
+            # Sumar los contadores del almacenamiento frío
+            cursor.execute('''
+                SELECT message_count, user_messages, bot_messages, total_tokens
+                FROM archived_sessions
+                WHERE session_id = ?
+            ''', (session_id,))
+            
+            archived = cursor.fetchone()
+            if archived:
+                stats = tuple((live or 0) + (cold or 0) for live, cold in zip(stats, archived))
+            
             # Obtener info de la sesión
             cursor.execute('''
                 SELECT created_at, last_activity
@@ -236,17 +500,41 @@ class DatabaseManager:
             print(f"Error al obtener estadísticas: {e}")
             return {}
     
+    @timed_method
+    def get_turn_count(self, session_id: str) -> int:
+        """Mensajes de usuario y asistente de una sesión (activos y archivados)"""
+        try:
+            conn = self._connect()
+            cursor = conn.cursor()
+            
+            cursor.execute('''
+                SELECT
+                    (SELECT COUNT(*) FROM messages
+                     WHERE session_id = ? AND role IN ('user', 'assistant')),
+                    (SELECT COALESCE(SUM(user_messages + bot_messages), 0) FROM archived_sessions
+                     WHERE session_id = ?)
+            ''', (session_id, session_id))
+            
+            live, archived = cursor.fetchone()
+            conn.close()
+            return live + archived
+        except Exception as e:
+            print(f"Error al contar mensajes: {e}")
+            return 0
+    
+    @timed_method
     def get_all_sessions(self, limit: int = 10) -> List[Dict]:
         """Obtiene todas las sesiones ordenadas por última actividad"""
         try:
-            conn = sqlite3.connect(self.db_path)
+            conn = self._connect()
             cursor = conn.cursor()
             
             cursor.execute('''
                 SELECT s.id, s.user_name, s.created_at, s.last_activity,
-                       COUNT(m.id) as message_count
+                       COUNT(m.id) + COALESCE(a.message_count, 0) as message_count
                 FROM sessions s
                 LEFT JOIN messages m ON s.id = m.session_id
+                LEFT JOIN archived_sessions a ON s.id = a.session_id
                 GROUP BY s.id
                 ORDER BY s.last_activity DESC
                 LIMIT ?
@@ -268,14 +556,368 @@ class DatabaseManager:
             print(f"Error al obtener sesiones: {e}")
             return []
     
+    @timed_method
+    def archive_idle_sessions(self, idle_days: int = 30, codec: str = "zlib",
+                              dictionary: bytes = None) -> Dict:
+        """Mueve los mensajes de sesiones inactivas a bloques comprimidos en archived_sessions"""
+        try:
+            if codec not in ("zlib", "zstd"):
+                raise ValueError(f"Códec no soportado: {codec}")
+            if codec == "zstd" and zstandard is None:
+                raise ValueError("El códec zstd requiere el paquete 'zstandard'")
+            
+            conn = self._connect()
+            cursor = conn.cursor()
+            
+            cursor.execute('''
+                SELECT s.id
+                FROM sessions s
+                WHERE s.last_activity < datetime('now', ?)
+                  AND EXISTS (SELECT 1 FROM messages m WHERE m.session_id = s.id)
+            ''', (f'{-int(idle_days)} days',))
+            session_ids = [row[0] for row in cursor.fetchall()]
+            
+            # El diccionario solo se guarda si algún bloque lo usa (reutilizando uno idéntico)
+            dictionary_id = None
+            if dictionary and session_ids:
+                cursor.execute('''
+                    SELECT id FROM archive_dictionaries WHERE codec = ? AND data = ?
+                ''', (codec, dictionary))
+                row = cursor.fetchone()
+                if row:
+                    dictionary_id = row[0]
+                else:
+                    cursor.execute('''
+                        INSERT INTO archive_dictionaries (codec, data) VALUES (?, ?)
+                    ''', (codec, dictionary))
+                    dictionary_id = cursor.lastrowid
+            
+            result = {
+                'sessions': 0,
+                'messages': 0,
+                'raw_bytes': 0,
+                'compressed_bytes': 0,
+                'session_ids': []
+            }
+            
+            for session_id in session_ids:
+                # Un bloque por sesión: lo ya archivado más los mensajes activos
+                messages = self._load_archived_messages(cursor, session_id)
+                cursor.execute('''
+                    SELECT role, content, timestamp, tokens_used
+                    FROM messages
+                    WHERE session_id = ?
+                    ORDER BY timestamp ASC, id ASC
+                ''', (session_id,))
+                live_rows = cursor.fetchall()
+                messages.extend(
+                    {'role': row[0], 'content': row[1], 'timestamp': row[2], 'tokens_used': row[3]}
+                    for row in live_rows
+                )
+                
+                raw = json.dumps(
+                    [[m['role'], m['content'], m['timestamp'], m['tokens_used']] for m in messages],
+                    ensure_ascii=False, separators=(',', ':')
+                ).encode('utf-8')
+                block = self._compress_block(raw, codec, dictionary)
+                
+                cursor.execute('''
+                    INSERT OR REPLACE INTO archived_sessions
+                        (session_id, codec, dictionary_id, content, message_count, user_messages,
+                         bot_messages, total_tokens, raw_bytes, compressed_bytes, archived_at)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+                ''', (
+                    session_id, codec, dictionary_id, block, len(messages),
+                    sum(1 for m in messages if m['role'] == 'user'),
+                    sum(1 for m in messages if m['role'] == 'assistant'),
+                    sum(m['tokens_used'] or 0 for m in messages),
+                    len(raw), len(block)
+                ))
+                cursor.execute('DELETE FROM messages WHERE session_id = ?', (session_id,))
+                
+                result['sessions'] += 1
+                result['messages'] += len(live_rows)
+                result['raw_bytes'] += len(raw)
+                result['compressed_bytes'] += len(block)
+                result['session_ids'].append(session_id)
+            
+            self._prune_archive_dictionaries(cursor)
+            conn.commit()
+            conn.close()
+            
+            result['saved_bytes'] = result['raw_bytes'] - result['compressed_bytes']
+            print(f"✅ Sesiones archivadas: {result['sessions']} "
+                  f"({result['raw_bytes']} → {result['compressed_bytes']} bytes)")
+            return result
+        except Exception as e:
+            print(f"Error al archivar sesiones: {e}")
+            return {}
+    
+    @timed_method
+    def build_archive_dictionary(self, max_bytes: int = 32 * 1024) -> bytes:
+        """Construye un diccionario compartido con los contenidos más repetidos"""
+        try:
+            conn = self._connect()
+            cursor = conn.cursor()
+            
+            cursor.execute('''
+                SELECT content
+                FROM messages
+                GROUP BY content
+                ORDER BY COUNT(*) DESC
+                LIMIT 200
+            ''')
+            
+            dictionary = b''
+            for row in cursor.fetchall():
+                chunk = row[0].encode('utf-8')
+                if len(dictionary) + len(chunk) > max_bytes:
+                    break
+                # zlib aprovecha mejor el final del diccionario: lo más común va al final
+                dictionary = chunk + dictionary
+            
+            conn.close()
+            return dictionary
+        except Exception as e:
+            print(f"Error al construir diccionario: {e}")
+            return b''
+    
+    @timed_method
+    def get_archive_stats(self) -> Dict:
+        """Obtiene el ahorro de espacio del almacenamiento frío"""
+        try:
+            conn = self._connect()
+            cursor = conn.cursor()
+            
+            cursor.execute('''
+                SELECT COUNT(*), SUM(message_count), SUM(raw_bytes), SUM(compressed_bytes)
+                FROM archived_sessions
+            ''')
+            
+            stats = cursor.fetchone()
+            conn.close()
+            
+            raw_bytes = stats[2] or 0
+            compressed_bytes = stats[3] or 0
+            return {
+                'archived_sessions': stats[0] or 0,
+                'archived_messages': stats[1] or 0,
+                'raw_bytes': raw_bytes,
+                'compressed_bytes': compressed_bytes,
+                'saved_bytes': raw_bytes - compressed_bytes,
+                'ratio': (compressed_bytes / raw_bytes) if raw_bytes else 0
+            }
+        except Exception as e:
+            print(f"Error al obtener estadísticas del archivo: {e}")
+            return {}
+    
+    def _restore_archived_session(self, cursor, session_id: str) -> bool:
+        """Devuelve a messages el bloque archivado de una sesión, en orden cronológico"""
+        messages = self._load_archived_messages(cursor, session_id)
+        if not messages:
+            return False
+        
+        # Los activos escritos después de archivar se reinsertan detrás del bloque
+        cursor.execute('''
+            SELECT role, content, timestamp, tokens_used
+            FROM messages
+            WHERE session_id = ?
+            ORDER BY id ASC
+        ''', (session_id,))
+        live_rows = cursor.fetchall()
+        cursor.execute('DELETE FROM messages WHERE session_id = ?', (session_id,))
+        
+        cursor.executemany('''
+            INSERT INTO messages (session_id, role, content, timestamp, tokens_used)
+            VALUES (?, ?, ?, ?, ?)
+        ''', [(session_id, m['role'], m['content'], m['timestamp'], m['tokens_used']) for m in messages]
+            + [(session_id,) + tuple(row) for row in live_rows])
+        cursor.execute('DELETE FROM archived_sessions WHERE session_id = ?', (session_id,))
+        return True
+    
+    def _prune_archive_dictionaries(self, cursor):
+        """Elimina los diccionarios que ya no usa ningún bloque archivado"""
+        cursor.execute('''
+            DELETE FROM archive_dictionaries
+            WHERE id NOT IN (
+                SELECT dictionary_id FROM archived_sessions WHERE dictionary_id IS NOT NULL
+            )
+        ''')
+    
+    def _load_archived_messages(self, cursor, session_id: str) -> List[Dict]:
+        """Descomprime el bloque archivado de una sesión (lista vacía si no existe)"""
+        cursor.execute('''
+            SELECT a.codec, a.content, d.data
+            FROM archived_sessions a
+            LEFT JOIN archive_dictionaries d ON a.dictionary_id = d.id
+            WHERE a.session_id = ?
+        ''', (session_id,))
+        
+        row = cursor.fetchone()
+        if not row:
+            return []
+        
+        raw = self._decompress_block(row[1], row[0], row[2])
+        return [
+            {'role': role, 'content': content, 'timestamp': timestamp, 'tokens_used': tokens_used}
+            for role, content, timestamp, tokens_used in json.loads(raw.decode('utf-8'))
+        ]
+    
+    @staticmethod
+    def _compress_block(raw: bytes, codec: str, dictionary: bytes = None) -> bytes:
+        """Comprime un bloque con zlib o zstd, opcionalmente con diccionario"""
+        if codec == "zstd":
+            dict_data = zstandard.ZstdCompressionDict(dictionary) if dictionary else None
+            return zstandard.ZstdCompressor(level=19, dict_data=dict_data).compress(raw)
+        
+        if dictionary:
+            compressor = zlib.compressobj(level=9, zdict=dictionary)
+        else:
+            compressor = zlib.compressobj(level=9)
+        return compressor.compress(raw) + compressor.flush()
+    
+    @staticmethod
+    def _decompress_block(block: bytes, codec: str, dictionary: bytes = None) -> bytes:
+        """Descomprime un bloque generado por _compress_block"""
+        if codec == "zstd":
+            if zstandard is None:
+                raise RuntimeError("El códec zstd requiere el paquete 'zstandard'")
+            dict_data = zstandard.ZstdCompressionDict(dictionary) if dictionary else None
+            return zstandard.ZstdDecompressor(dict_data=dict_data).decompress(block)
+        
+        if dictionary:
+            decompressor = zlib.decompressobj(zdict=dictionary)
+        else:
+            decompressor = zlib.decompressobj()
+        return decompressor.decompress(block) + decompressor.flush()
+    
+    @timed_method
+    def add_token_usage(self, usage: List[tuple]) -> bool:
+        """Suma tokens a los contadores por ventana: [(scope, key, bucket_start, tokens), ...]"""
+        try:
+            conn = self._connect()
+            cursor = conn.cursor()
+            
+            cursor.executemany('''
+                INSERT INTO token_usage (scope, key, bucket_start, tokens)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT (scope, key, bucket_start)
+                DO UPDATE SET tokens = tokens + excluded.tokens
+            ''', usage)
+            
+            conn.commit()
+            conn.close()
+            return True
+        except Exception as e:
+            print(f"Error al guardar uso de tokens: {e}")
+            return False
+    
+    @timed_method
+    def get_token_usage(self, since: int) -> List[tuple]:
+        """Obtiene los contadores de tokens desde un instante (epoch en segundos)"""
+        try:
+            conn = self._connect()
+            cursor = conn.cursor()
+            
+            cursor.execute('''
+                SELECT scope, key, bucket_start, tokens
+                FROM token_usage
+                WHERE bucket_start >= ?
+            ''', (since,))
+            
+            usage = cursor.fetchall()
+            conn.close()
+            return usage
+        except Exception as e:
+            print(f"Error al obtener uso de tokens: {e}")
+            return []
+    
+    @timed_method
+    def prune_token_usage(self, before: int) -> bool:
+        """Elimina los contadores de tokens anteriores a un instante (epoch en segundos)"""
+        try:
+            conn = self._connect()
+            cursor = conn.cursor()
+            
+            cursor.execute('DELETE FROM token_usage WHERE bucket_start < ?', (before,))
+            
+            conn.commit()
+            conn.close()
+            return True
+        except Exception as e:
+            print(f"Error al podar uso de tokens: {e}")
+            return False
+    
+    @timed_method
+    def record_route_stats(self, route: str, category: str, latency: float, tokens: int,
+                           cost: float, alpha: float = 0.2) -> bool:
+        """Acumula latencia, tokens y coste observados de una ruta de modelo"""
+        try:
+            conn = self._connect()
+            cursor = conn.cursor()
+            
+            cursor.execute('''
+                INSERT INTO route_stats
+                    (route, category, requests, ewma_latency, ewma_tokens,
+                     total_latency, total_tokens, total_cost, updated_at)
+                VALUES (?, ?, 1, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+                ON CONFLICT (route, category) DO UPDATE SET
+                    requests = requests + 1,
+                    ewma_latency = ewma_latency + ? * (excluded.ewma_latency - ewma_latency),
+                    ewma_tokens = ewma_tokens + ? * (excluded.ewma_tokens - ewma_tokens),
+                    total_latency = total_latency + excluded.total_latency,
+                    total_tokens = total_tokens + excluded.total_tokens,
+                    total_cost = total_cost + excluded.total_cost,
+                    updated_at = CURRENT_TIMESTAMP
+            ''', (route, category, latency, tokens, latency, tokens, cost, alpha, alpha))
+            
+            conn.commit()
+            conn.close()
+            return True
+        except Exception as e:
+            print(f"Error al guardar estadísticas de ruta: {e}")
+            return False
+    
+    @timed_method
+    def get_route_stats(self) -> List[Dict]:
+        """Obtiene las estadísticas acumuladas de todas las rutas de modelo"""
+        try:
+            conn = self._connect()
+            cursor = conn.cursor()
+            
+            cursor.execute('''
+                SELECT route, category, requests, ewma_latency, ewma_tokens,
+                       total_latency, total_tokens, total_cost
+                FROM route_stats
+            ''')
+            
+            stats = []
+            for row in cursor.fetchall():
+                stats.append({
+                    'route': row[0],
+                    'category': row[1],
+                    'requests': row[2],
+                    'ewma_latency': row[3],
+                    'ewma_tokens': row[4],
+                    'total_latency': row[5],
+                    'total_tokens': row[6],
+                    'total_cost': row[7]
+                })
+            
+            conn.close()
+            return stats
+        except Exception as e:
+            print(f"Error al obtener estadísticas de rutas: {e}")
+            return []
+    
+    @timed_method
     def backup_database(self, backup_path: str = None) -> bool:
         """Crea un backup de la base de datos"""
         try:
             if not backup_path:
                 backup_path = f"backup_chatbot_{datetime.now().strftime('%Y%m%d_%H%M%S')}.db"
             
-            import shutil
-            shutil.copy2(self.db_path, backup_path)
+            self.engine.backup(backup_path)
             print(f"✅ Backup creado: {backup_path}")
             return True
         except Exception as e:
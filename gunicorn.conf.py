@@ -0,0 +1,93 @@
+"""
+Configuración de producción (varios workers) del chatbot
+Uso: gunicorn -c gunicorn.conf.py app:app
+
+Con preload_app los workers nacen del master, que conserva el código importado
+al arrancar: kill -HUP solo recarga la configuración. Para desplegar código
+nuevo sin cortes se hace una actualización binaria:
+    kill -USR2 <pid del master>         # arranca un master nuevo con el código nuevo
+    kill -WINCH <pid del master viejo>  # para sus workers cuando el nuevo atiende
+    kill -QUIT <pid del master viejo>   # termina el master viejo
+
+Cada worker tiene su propio registro de métricas: los vuelca a METRICS_DIR y
+/metrics devuelve la suma de todos (incluidos los workers ya reciclados).
+"""
+
+import multiprocessing
+import os
+import shutil
+import tempfile
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+bind = os.getenv("BIND", "0.0.0.0:5000")
+
+# Un worker por núcleo; hilos para solapar las esperas a OpenAI
+workers = int(os.getenv("WEB_CONCURRENCY", multiprocessing.cpu_count()))
+worker_class = "gthread"
+threads = int(os.getenv("WEB_THREADS", "4"))
+
+# La app se importa una vez en el master y los workers la heredan por fork
+preload_app = True
+
+# Reciclado de workers para acotar fugas de memoria (con jitter para no reciclar todos a la vez)
+max_requests = int(os.getenv("MAX_REQUESTS", "1000"))
+max_requests_jitter = int(os.getenv("MAX_REQUESTS_JITTER", "100"))
+
+# Tiempo para terminar peticiones en curso durante una recarga o parada
+graceful_timeout = int(os.getenv("GRACEFUL_TIMEOUT", "30"))
+timeout = int(os.getenv("WORKER_TIMEOUT", "60"))
+
+accesslog = "-"
+
+# Directorio compartido de métricas por worker (un subdirectorio por master)
+metrics_dir = os.getenv("METRICS_DIR") or os.path.join(tempfile.gettempdir(), "chatbot_metrics")
+
+
+def on_starting(server):
+    """Valida la configuración antes de arrancar los workers"""
+    if not os.getenv("SECRET_KEY"):
+        raise RuntimeError("SECRET_KEY es obligatoria con varios workers: "
+                           "sin ella cada worker firma las cookies de sesión con otra clave")
+
+    # server.cfg incluye lo pasado por línea de comandos (gunicorn -w N)
+    workers = server.cfg.workers
+    if workers > 1 and os.getenv("CHATBOT_DB", "chatbot.db").startswith(("memory://", ":memory:")):
+        raise RuntimeError("El motor en memoria no se comparte entre procesos; "
+                           "usa un archivo SQLite con varios workers")
+
+    if workers > 1 and os.getenv("CACHE_BACKEND", "local").lower() == "local":
+        server.log.warning("CACHE_BACKEND=local: cada worker tendrá su propia caché; "
+                           "usa 'tiered' o 'sqlite' para compartirla")
+
+    # Una ROUTING_CONFIG incompleta debe fallar aquí y no en la primera petición
+    from routing import ModelRouter
+    ModelRouter.from_env()
+
+    # Importar openai en el master para que los workers lo hereden ya cargado
+    import openai  # noqa: F401
+
+    # Un directorio por master: en una actualización binaria (USR2) el master
+    # viejo y el nuevo conviven sin mezclar ni borrar las métricas del otro
+    server.metrics_dir = os.path.join(metrics_dir, str(os.getpid()))
+    shutil.rmtree(server.metrics_dir, ignore_errors=True)
+    os.makedirs(server.metrics_dir)
+
+
+def post_fork(server, worker):
+    """Cada worker vuelca su registro de métricas al directorio compartido"""
+    from metrics import start_worker_snapshots
+    start_worker_snapshots(server.metrics_dir)
+
+
+def child_exit(server, worker):
+    """Conserva las métricas de un worker que termina (reciclado o caído)"""
+    from metrics import retire_worker
+    retire_worker(server.metrics_dir, worker.pid)
+
+
+def on_exit(server):
+    """Borra las métricas de este master al pararlo"""
+    shutil.rmtree(server.metrics_dir, ignore_errors=True)
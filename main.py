@@ -1,32 +1,107 @@
+import argparse
 import os
+import sys
+import uuid
 from dotenv import load_dotenv
 from openai import OpenAI
+from database import CONTEXT_WINDOW, DEFAULT_SYSTEM_PROMPT, DatabaseManager, window_messages
 
-load_dotenv()
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+def parse_args():
+    """Opciones del cliente de terminal"""
+    parser = argparse.ArgumentParser(description="Chatbot AI en la terminal")
+    parser.add_argument("--persist", action="store_true",
+                        help="guardar la conversación en la base de datos")
+    parser.add_argument("--session", help="reanudar una sesión guardada (implica --persist)")
+    parser.add_argument("--db", default=os.getenv("CHATBOT_DB", "chatbot.db"),
+                        help="base de datos para --persist (ruta o memory://<nombre>)")
+    parser.add_argument("--context", type=int, default=CONTEXT_WINDOW,
+                        help="mensajes de la conversación enviados en cada turno")
+    return parser.parse_args()
 
-mensajes = [
-    {"role": "system", "content": "Eres un asistente relajado y divertido."}
-]
+def stream_reply(client, mensajes):
+    """Imprime la respuesta a medida que llegan los tokens y la devuelve completa"""
+    partes = []
+    tokens_used = 0
+    stream = client.chat.completions.create(
+        model="gpt-3.5-turbo",
+        messages=mensajes,
+        stream=True,
+        stream_options={"include_usage": True}
+    )
 
-print("🤖 Hola, como puedo ayudarte hoy? Para terminar escribe salir.\n")
+    print("\nIA: ", end="", flush=True)
+    try:
+        for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                texto = chunk.choices[0].delta.content
+                partes.append(texto)
+                sys.stdout.write(texto)
+                sys.stdout.flush()
+            if chunk.usage:
+                tokens_used = chunk.usage.total_tokens
+    except KeyboardInterrupt:
+        # Ctrl+C corta la respuesta en curso sin salir del chat
+        stream.close()
+        print(" [interrumpido]", end="")
+    print("\n")
 
-while True:
-    entrada = input("Tú: ")
-    if entrada.lower() == "salir":
-        print("👋 Nos vemos.")
-        break
+    return "".join(partes), tokens_used
 
-    mensajes.append({"role": "user", "content": entrada})
+def main():
+    args = parse_args()
+    load_dotenv()
+    if os.getenv("OPENAI_PROVIDER") == "mock":
+        from mock_provider import MockOpenAIClient
+        client = MockOpenAIClient.from_env()
+    else:
+        client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
 
-    try:
-        respuesta = client.chat.completions.create(
-            model="gpt-3.5-turbo",
-            messages=mensajes
-        )
-        contenido = respuesta.choices[0].message.content
-        mensajes.append({"role": "assistant", "content": contenido})
-        print("\nIA:", contenido + "\n")
-
-    except Exception as e:
-        print("⚠️  Ocurrió un error:", e)
+    db = None
+    session_id = None
+    if args.persist or args.session:
+        db = DatabaseManager(args.db)
+        session_id = args.session or str(uuid.uuid4())
+        if args.session:
+            # Sin esta comprobación una sesión mal escrita se crearía vacía y sin prompt
+            if not db.get_session_stats(session_id).get('created_at'):
+                print(f"❌ No existe la sesión {session_id} en {args.db}")
+                sys.exit(1)
+            mensajes = db.get_openai_messages(session_id, args.context)
+            print(f"💾 Sesión reanudada: {session_id} ({len(mensajes)} mensajes en contexto)")
+        else:
+            db.create_session(session_id, "cli")
+            mensajes = db.get_openai_messages(session_id, args.context)
+            print(f"💾 Sesión guardada como: {session_id}")
+    else:
+        mensajes = [{"role": "system", "content": DEFAULT_SYSTEM_PROMPT}]
+
+    print("🤖 Hola, como puedo ayudarte hoy? Para terminar escribe salir.\n")
+
+    while True:
+        try:
+            entrada = input("Tú: ")
+        except (EOFError, KeyboardInterrupt):
+            entrada = "salir"
+        if entrada.lower() == "salir":
+            print("👋 Nos vemos.")
+            if session_id:
+                print(f"   Para continuar: python main.py --session {session_id}")
+            break
+
+        mensajes.append({"role": "user", "content": entrada})
+        # Misma ventana de contexto que la aplicación web
+        mensajes = window_messages(mensajes, args.context)
+        if db:
+            db.add_message(session_id, "user", entrada)
+
+        try:
+            contenido, tokens_used = stream_reply(client, mensajes)
+            mensajes.append({"role": "assistant", "content": contenido})
+            if db:
+                db.add_message(session_id, "assistant", contenido, tokens_used)
+
+        except Exception as e:
+            print("⚠️  Ocurrió un error:", e)
+
+if __name__ == "__main__":
+    main()
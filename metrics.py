@@ -0,0 +1,397 @@
+"""
+Métricas de rendimiento del chatbot en formato Prometheus
+Histogramas y contadores ligeros (sin dependencias) para dejarlos activos en producción
+
+Con varios workers (METRICS_DIR) cada proceso vuelca periódicamente su registro
+a un archivo del directorio compartido y /metrics suma los de todos, así los
+contadores no saltan según el worker que atienda el scrape
+"""
+
+import atexit
+import bisect
+import functools
+import glob
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Tuple
+
+# Buckets por defecto en segundos (de 0.5 ms a 30 s)
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _format_labels(labelnames: Tuple[str, ...], labelvalues: Tuple[str, ...], extra: str = "") -> str:
+    """Convierte etiquetas a la sintaxis {a="x",b="y"} de Prometheus"""
+    parts = [f'{name}="{value}"' for name, value in zip(labelnames, labelvalues)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Counter:
+    """Contador monotónico con etiquetas"""
+
+    def __init__(self, name: str, help_text: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = labelnames
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def snapshot(self) -> Dict[Tuple[str, ...], float]:
+        with self._lock:
+            return dict(self._values)
+
+    def reset(self):
+        with self._lock:
+            self._values.clear()
+
+    @staticmethod
+    def merge(values: Dict, other: Dict):
+        """Suma `other` sobre `values` (ambos en el formato de snapshot())"""
+        for key, value in other.items():
+            values[key] = values.get(key, 0) + value
+
+    def render(self, values: Dict = None) -> List[str]:
+        values = self.snapshot() if values is None else values
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        for key, value in sorted(values.items()):
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {value}")
+        return lines
+
+
+class Histogram:
+    """Histograma acumulativo con etiquetas (buckets fijos, O(log n) por observación)"""
+
+    def __init__(self, name: str, help_text: str, labelnames: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = labelnames
+        self.buckets = tuple(sorted(buckets))
+        # Por cada combinación de etiquetas: [conteos por bucket..., +Inf], suma
+        self._series: Dict[Tuple[str, ...], list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        """Mide la duración del bloque y la registra en el histograma"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def snapshot(self) -> Dict[Tuple[str, ...], list]:
+        with self._lock:
+            return {key: [list(series[0]), series[1]] for key, series in self._series.items()}
+
+    def reset(self):
+        with self._lock:
+            self._series.clear()
+
+    @staticmethod
+    def merge(series: Dict, other: Dict):
+        """Suma `other` sobre `series` bucket a bucket (formato de snapshot())"""
+        for key, (counts, total) in other.items():
+            current = series.get(key)
+            if current is None:
+                series[key] = [list(counts), total]
+            else:
+                current[0] = [a + b for a, b in zip(current[0], counts)]
+                current[1] += total
+
+    def render(self, series: Dict = None) -> List[str]:
+        series = self.snapshot() if series is None else series
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for key, (counts, total) in sorted(series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                labels = _format_labels(self.labelnames, key, f'le="{bound}"')
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            cumulative += counts[-1]
+            labels = _format_labels(self.labelnames, key, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {cumulative}")
+        return lines
+
+
+class Registry:
+    """Colección de métricas que se exponen juntas en /metrics"""
+
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def snapshot(self) -> Dict[str, list]:
+        """Valores de todas las métricas serializables a JSON"""
+        return {
+            metric.name: [[list(key), value] for key, value in metric.snapshot().items()]
+            for metric in self._metrics
+        }
+
+    def reset(self):
+        for metric in self._metrics:
+            metric.reset()
+
+    def merge(self, snapshots: List[Dict]) -> Dict[str, list]:
+        """Suma varios snapshots (p. ej. uno por worker) en uno solo"""
+        merged = {}
+        for metric in self._metrics:
+            values = {}
+            for snapshot in snapshots:
+                metric.merge(values, {tuple(key): value for key, value in snapshot.get(metric.name, [])})
+            merged[metric.name] = [[list(key), value] for key, value in values.items()]
+        return merged
+
+    def render(self, snapshot: Dict = None) -> str:
+        """Texto de Prometheus del proceso actual o de un snapshot (ya sumado)"""
+        lines = []
+        for metric in self._metrics:
+            if snapshot is None:
+                lines.extend(metric.render())
+            else:
+                lines.extend(metric.render({tuple(key): value for key, value in snapshot.get(metric.name, [])}))
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+CHAT_STAGE_SECONDS = registry.register(Histogram(
+    "chatbot_chat_stage_seconds",
+    "Duración de cada etapa de /chat",
+    ("stage",)
+))
+CHAT_ERRORS = registry.register(Counter(
+    "chatbot_chat_errors_total",
+    "Errores en /chat por etapa",
+    ("stage",)
+))
+DB_OPERATION_SECONDS = registry.register(Histogram(
+    "chatbot_db_operation_seconds",
+    "Duración de cada método de DatabaseManager",
+    ("method",)
+))
+DB_COMMIT_SECONDS = registry.register(Histogram(
+    "chatbot_db_commit_seconds",
+    "Duración de los commits de SQLite (incluye espera por bloqueo)"
+))
+DB_BUSY = registry.register(Counter(
+    "chatbot_db_busy_total",
+    "Sentencias SQLite que encontraron la base de datos ocupada o bloqueada",
+    ("operation", "outcome")
+))
+DB_LOCK_WAIT_SECONDS = registry.register(Histogram(
+    "chatbot_db_lock_wait_seconds",
+    "Tiempo esperado por un bloqueo de SQLite hasta obtenerlo o agotar el timeout"
+))
+TOKENS = registry.register(Counter(
+    "chatbot_tokens_total",
+    "Tokens consumidos por tipo",
+    ("kind",)
+))
+TOKENS_PER_SECOND = registry.register(Histogram(
+    "chatbot_completion_tokens_per_second",
+    "Throughput de tokens generados por petición",
+    buckets=(1, 5, 10, 20, 40, 60, 80, 100, 150, 200, 400)
+))
+QUOTA_DECISIONS = registry.register(Counter(
+    "chatbot_quota_decisions_total",
+    "Decisiones de cuota antes de llamar a OpenAI",
+    ("result", "scope")
+))
+
+
+def timed_method(func):
+    """Decorador que registra la duración de un método de DatabaseManager"""
+    method = func.__name__
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            DB_OPERATION_SECONDS.observe(time.perf_counter() - start, method=method)
+
+    return wrapper
+
+
+def _is_busy_error(error: sqlite3.OperationalError) -> bool:
+    message = str(error).lower()
+    return "locked" in message or "busy" in message
+
+
+def _retry_busy(busy_timeout: float, operation: str, call):
+    """Ejecuta `call` reintentando mientras SQLite esté ocupado y mide la espera"""
+    start = time.perf_counter()
+    delay = 0.001
+    waited = False
+    while True:
+        try:
+            result = call()
+        except sqlite3.OperationalError as e:
+            if not _is_busy_error(e):
+                raise
+            waited = True
+            elapsed = time.perf_counter() - start
+            if elapsed >= busy_timeout:
+                DB_BUSY.inc(operation=operation, outcome="timeout")
+                DB_LOCK_WAIT_SECONDS.observe(elapsed)
+                raise
+            time.sleep(min(delay, busy_timeout - elapsed))
+            delay = min(delay * 2, 0.05)
+            continue
+        if waited:
+            DB_BUSY.inc(operation=operation, outcome="acquired")
+            DB_LOCK_WAIT_SECONDS.observe(time.perf_counter() - start)
+        return result
+
+
+class InstrumentedCursor(sqlite3.Cursor):
+    """Cursor que reintenta y mide las esperas por bloqueo de SQLite"""
+
+    def execute(self, sql, parameters=()):
+        return _retry_busy(self.connection.busy_timeout, "execute",
+                           lambda: super(InstrumentedCursor, self).execute(sql, parameters))
+
+    def executemany(self, sql, seq_of_parameters):
+        # Materializar para poder reintentar con los mismos parámetros
+        parameters = list(seq_of_parameters)
+        return _retry_busy(self.connection.busy_timeout, "executemany",
+                           lambda: super(InstrumentedCursor, self).executemany(sql, parameters))
+
+
+class InstrumentedConnection(sqlite3.Connection):
+    """Conexión SQLite que mide commits y esperas por bloqueo y usa InstrumentedCursor
+
+    El busy timeout de SQLite se desactiva y la espera la hace _retry_busy, así
+    también se cuentan los bloqueos que terminan bien y no solo los que agotan
+    el timeout.
+    """
+
+    def __init__(self, *args, timeout: float = 5.0, **kwargs):
+        super().__init__(*args, timeout=0, **kwargs)
+        self.busy_timeout = timeout
+
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    # Connection.execute no pasa por cursor(): se redirige para reintentar igual
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def commit(self):
+        start = time.perf_counter()
+        try:
+            _retry_busy(self.busy_timeout, "commit", super().commit)
+        finally:
+            DB_COMMIT_SECONDS.observe(time.perf_counter() - start)
+
+
+def record_token_usage(usage, elapsed: float):
+    """Registra los tokens de una respuesta de OpenAI y su throughput"""
+    if usage is None:
+        return
+    prompt_tokens = getattr(usage, "prompt_tokens", 0) or 0
+    completion_tokens = getattr(usage, "completion_tokens", 0) or 0
+    TOKENS.inc(prompt_tokens, kind="prompt")
+    TOKENS.inc(completion_tokens, kind="completion")
+    if elapsed > 0 and completion_tokens:
+        TOKENS_PER_SECOND.observe(completion_tokens / elapsed)
+
+
+# Directorio compartido por los workers (lo fija gunicorn.conf.py); sin él, métricas del proceso
+METRICS_DIR = os.getenv("METRICS_DIR")
+_DEAD_WORKERS_FILE = "dead_workers.json"
+
+
+def _write_json(path: str, data):
+    """Escritura atómica: el lector nunca ve un archivo a medias"""
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+
+def _read_json(path: str):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def write_worker_snapshot(directory: str = None):
+    """Vuelca el registro de este proceso a <directorio>/worker_<pid>.json"""
+    directory = directory or METRICS_DIR
+    if directory:
+        _write_json(os.path.join(directory, f"worker_{os.getpid()}.json"), registry.snapshot())
+
+
+def start_worker_snapshots(directory: str, interval: float = 5.0):
+    """En cada worker tras el fork: registro limpio y volcado periódico al directorio compartido"""
+    global METRICS_DIR
+    METRICS_DIR = directory
+    # Lo heredado del master por el fork ya no pertenece a este worker
+    registry.reset()
+
+    def loop():
+        while True:
+            time.sleep(interval)
+            try:
+                write_worker_snapshot(directory)
+            except OSError as e:
+                print(f"Error al volcar métricas: {e}")
+
+    threading.Thread(target=loop, name="metrics-snapshot", daemon=True).start()
+    atexit.register(write_worker_snapshot, directory)
+
+
+def retire_worker(directory: str, pid: int):
+    """En el master al morir un worker: acumula su último volcado para no reiniciar contadores"""
+    path = os.path.join(directory, f"worker_{pid}.json")
+    snapshot = _read_json(path)
+    if snapshot is None:
+        return
+    dead_path = os.path.join(directory, _DEAD_WORKERS_FILE)
+    dead = _read_json(dead_path)
+    _write_json(dead_path, registry.merge([snapshot] + ([dead] if dead else [])))
+    os.remove(path)
+
+
+def render_metrics() -> str:
+    """Devuelve todas las métricas en formato de texto de Prometheus (sumadas entre workers)"""
+    if not METRICS_DIR:
+        return registry.render()
+
+    write_worker_snapshot(METRICS_DIR)
+    snapshots = [_read_json(path) for path in glob.glob(os.path.join(METRICS_DIR, "*.json"))]
+    return registry.render(registry.merge([snapshot for snapshot in snapshots if snapshot]))
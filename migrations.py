@@ -0,0 +1,271 @@
+"""
+Migraciones versionadas del esquema de la base de datos
+La versión aplicada se guarda en PRAGMA user_version; si el esquema está al
+día no se ejecuta ningún DDL
+"""
+
+import sqlite3
+from typing import List
+
+# Cada migración: (versión, descripción, sentencias). Solo se añaden al final.
+MIGRATIONS = [
+    (1, "Esquema inicial: sesiones, mensajes y configuraciones", [
+        '''
+        CREATE TABLE IF NOT EXISTS sessions (
+            id TEXT PRIMARY KEY,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            last_activity TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            user_name TEXT,
+            session_data TEXT
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS messages (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            session_id TEXT,
+            role TEXT CHECK(role IN ('system', 'user', 'assistant')),
+            content TEXT NOT NULL,
+            timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            tokens_used INTEGER DEFAULT 0,
+            FOREIGN KEY (session_id) REFERENCES sessions (id)
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS settings (
+            key TEXT PRIMARY KEY,
+            value TEXT,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_messages_session ON messages(session_id)',
+        'CREATE INDEX IF NOT EXISTS idx_messages_timestamp ON messages(timestamp)',
+        'CREATE INDEX IF NOT EXISTS idx_sessions_activity ON sessions(last_activity)',
+    ]),
+    (2, "Almacenamiento frío comprimido", [
+        '''
+        CREATE TABLE IF NOT EXISTS archived_sessions (
+            session_id TEXT PRIMARY KEY,
+            codec TEXT NOT NULL,
+            dictionary_id INTEGER,
+            content BLOB NOT NULL,
+            message_count INTEGER DEFAULT 0,
+            user_messages INTEGER DEFAULT 0,
+            bot_messages INTEGER DEFAULT 0,
+            total_tokens INTEGER DEFAULT 0,
+            raw_bytes INTEGER DEFAULT 0,
+            compressed_bytes INTEGER DEFAULT 0,
+            archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (session_id) REFERENCES sessions (id),
+            FOREIGN KEY (dictionary_id) REFERENCES archive_dictionaries (id)
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS archive_dictionaries (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            codec TEXT NOT NULL,
+            data BLOB NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+    ]),
+    (3, "Contadores de tokens por ventana para las cuotas", [
+        '''
+        CREATE TABLE IF NOT EXISTS token_usage (
+            scope TEXT NOT NULL,
+            key TEXT NOT NULL,
+            bucket_start INTEGER NOT NULL,
+            tokens INTEGER DEFAULT 0,
+            PRIMARY KEY (scope, key, bucket_start)
+        )
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_token_usage_bucket ON token_usage(bucket_start)',
+    ]),
+    (4, "Plantillas de prompt del sistema referenciadas desde sessions", [
+        '''
+        CREATE TABLE prompt_templates (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            version INTEGER NOT NULL,
+            content TEXT NOT NULL UNIQUE,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            UNIQUE (name, version)
+        )
+        ''',
+        'ALTER TABLE sessions ADD COLUMN prompt_template_id INTEGER REFERENCES prompt_templates (id)',
+        # Una plantilla por cada prompt del sistema distinto ya guardado, con
+        # versiones 1, 2, ... en orden de aparición
+        '''
+        INSERT INTO prompt_templates (name, version, content)
+        SELECT 'legacy', ROW_NUMBER() OVER (ORDER BY MIN(id)), content
+        FROM messages
+        WHERE role = 'system'
+        GROUP BY content
+        ''',
+        '''
+        UPDATE sessions SET prompt_template_id = (
+            SELECT t.id
+            FROM messages m
+            JOIN prompt_templates t ON t.content = m.content
+            WHERE m.session_id = sessions.id AND m.role = 'system'
+            ORDER BY m.id
+            LIMIT 1
+        )
+        ''',
+        # Eliminar las copias del prompt que ahora resuelve la plantilla
+        '''
+        DELETE FROM messages
+        WHERE role = 'system' AND EXISTS (
+            SELECT 1
+            FROM sessions s
+            JOIN prompt_templates t ON t.id = s.prompt_template_id
+            WHERE s.id = messages.session_id AND t.content = messages.content
+        )
+        ''',
+    ]),
+    (5, "Estadísticas de latencia y coste por ruta de modelo", [
+        '''
+        CREATE TABLE route_stats (
+            route TEXT NOT NULL,
+            category TEXT NOT NULL,
+            requests INTEGER DEFAULT 0,
+            ewma_latency REAL DEFAULT 0,
+            ewma_tokens REAL DEFAULT 0,
+            total_latency REAL DEFAULT 0,
+            total_tokens INTEGER DEFAULT 0,
+            total_cost REAL DEFAULT 0,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (route, category)
+        )
+        ''',
+    ]),
+    (6, "Rollups de uso por hora y por día", [
+        '''
+        CREATE TABLE usage_hourly (
+            bucket_start TEXT PRIMARY KEY,
+            messages INTEGER DEFAULT 0,
+            user_messages INTEGER DEFAULT 0,
+            assistant_messages INTEGER DEFAULT 0,
+            tokens INTEGER DEFAULT 0,
+            active_sessions INTEGER DEFAULT 0,
+            latency_count INTEGER DEFAULT 0,
+            latency_sum REAL DEFAULT 0
+        )
+        ''',
+        '''
+        CREATE TABLE usage_hourly_sessions (
+            bucket_start TEXT NOT NULL,
+            session_id TEXT NOT NULL,
+            PRIMARY KEY (bucket_start, session_id)
+        )
+        ''',
+        '''
+        CREATE TABLE usage_latency_hourly (
+            bucket_start TEXT NOT NULL,
+            latency_bucket INTEGER NOT NULL,
+            count INTEGER DEFAULT 0,
+            PRIMARY KEY (bucket_start, latency_bucket)
+        )
+        ''',
+        # Rellenar con el historial existente (sin latencias, que no se guardaban)
+        '''
+        INSERT INTO usage_hourly
+            (bucket_start, messages, user_messages, assistant_messages, tokens, active_sessions)
+        SELECT strftime('%Y-%m-%d %H:00:00', timestamp), COUNT(*),
+               COUNT(CASE WHEN role = 'user' THEN 1 END),
+               COUNT(CASE WHEN role = 'assistant' THEN 1 END),
+               COALESCE(SUM(tokens_used), 0), COUNT(DISTINCT session_id)
+        FROM messages
+        WHERE role IN ('user', 'assistant')
+        GROUP BY 1
+        ''',
+        '''
+        INSERT INTO usage_hourly_sessions (bucket_start, session_id)
+        SELECT DISTINCT strftime('%Y-%m-%d %H:00:00', timestamp), session_id
+        FROM messages
+        WHERE role IN ('user', 'assistant')
+        ''',
+        '''
+        CREATE TABLE usage_daily (
+            bucket_start TEXT PRIMARY KEY,
+            messages INTEGER DEFAULT 0,
+            user_messages INTEGER DEFAULT 0,
+            assistant_messages INTEGER DEFAULT 0,
+            tokens INTEGER DEFAULT 0,
+            active_sessions INTEGER DEFAULT 0,
+            latency_count INTEGER DEFAULT 0,
+            latency_sum REAL DEFAULT 0
+        )
+        ''',
+        '''
+        CREATE TABLE usage_daily_sessions (
+            bucket_start TEXT NOT NULL,
+            session_id TEXT NOT NULL,
+            PRIMARY KEY (bucket_start, session_id)
+        )
+        ''',
+        '''
+        CREATE TABLE usage_latency_daily (
+            bucket_start TEXT NOT NULL,
+            latency_bucket INTEGER NOT NULL,
+            count INTEGER DEFAULT 0,
+            PRIMARY KEY (bucket_start, latency_bucket)
+        )
+        ''',
+        # Rellenar con el historial existente (sin latencias, que no se guardaban)
+        '''
+        INSERT INTO usage_daily
+            (bucket_start, messages, user_messages, assistant_messages, tokens, active_sessions)
+        SELECT strftime('%Y-%m-%d 00:00:00', timestamp), COUNT(*),
+               COUNT(CASE WHEN role = 'user' THEN 1 END),
+               COUNT(CASE WHEN role = 'assistant' THEN 1 END),
+               COALESCE(SUM(tokens_used), 0), COUNT(DISTINCT session_id)
+        FROM messages
+        WHERE role IN ('user', 'assistant')
+        GROUP BY 1
+        ''',
+        '''
+        INSERT INTO usage_daily_sessions (bucket_start, session_id)
+        SELECT DISTINCT strftime('%Y-%m-%d 00:00:00', timestamp), session_id
+        FROM messages
+        WHERE role IN ('user', 'assistant')
+        ''',
+    ]),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def get_schema_version(conn: sqlite3.Connection) -> int:
+    """Versión del esquema guardada en la base de datos"""
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+
+def apply_migrations(conn: sqlite3.Connection) -> List[int]:
+    """Aplica en orden las migraciones pendientes y devuelve las versiones aplicadas"""
+    if get_schema_version(conn) >= LATEST_VERSION:
+        return []
+
+    applied = []
+    previous_isolation = conn.isolation_level
+    conn.isolation_level = None  # control manual de la transacción
+    try:
+        # BEGIN IMMEDIATE serializa migraciones concurrentes de varios procesos
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            current = get_schema_version(conn)
+            for version, _description, statements in MIGRATIONS:
+                if version <= current:
+                    continue
+                for statement in statements:
+                    conn.execute(statement)
+                applied.append(version)
+            if applied:
+                conn.execute(f'PRAGMA user_version = {applied[-1]}')
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+    finally:
+        conn.isolation_level = previous_isolation
+
+    return applied
@@ -0,0 +1,79 @@
+"""
+Proveedor local que imita la API de chat de OpenAI
+Sirve para pruebas, pruebas de carga y demos sin API key (OPENAI_PROVIDER=mock)
+"""
+
+import json
+import os
+import time
+from types import SimpleNamespace
+from typing import Dict, List
+
+
+def _estimate_tokens(text: str) -> int:
+    """Aproximación barata: ~4 caracteres por token"""
+    return max(len(text) // 4, 1)
+
+
+class _MockStream:
+    """Iterador de chunks compatible con stream=True"""
+
+    def __init__(self, words: List[str], usage):
+        self._words = words
+        self._usage = usage
+        self._closed = False
+
+    def __iter__(self):
+        for index, word in enumerate(self._words):
+            if self._closed:
+                return
+            text = word if index == 0 else " " + word
+            delta = SimpleNamespace(content=text)
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=delta)], usage=None)
+        yield SimpleNamespace(choices=[], usage=self._usage)
+
+    def close(self):
+        self._closed = True
+
+
+class MockOpenAIClient:
+    """Cliente con la forma de OpenAI().chat.completions.create y latencia configurable por modelo"""
+
+    def __init__(self, latencies: Dict[str, float] = None, default_latency: float = 0.0):
+        self.latencies = latencies or {}
+        self.default_latency = default_latency
+        self.calls = []
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+
+    @classmethod
+    def from_env(cls) -> "MockOpenAIClient":
+        """Latencias desde MOCK_LATENCIES (JSON {modelo: segundos}) y MOCK_DEFAULT_LATENCY"""
+        return cls(
+            latencies=json.loads(os.getenv("MOCK_LATENCIES", "{}")),
+            default_latency=float(os.getenv("MOCK_DEFAULT_LATENCY", "0"))
+        )
+
+    def _create(self, model: str, messages: List[Dict], max_tokens: int = None,
+                temperature: float = None, stream: bool = False, **kwargs):
+        self.calls.append({'model': model, 'max_tokens': max_tokens, 'messages': len(messages)})
+
+        latency = self.latencies.get(model, self.default_latency)
+        if latency:
+            time.sleep(latency)
+
+        last_user = next((m['content'] for m in reversed(messages) if m['role'] == 'user'), "")
+        words = f"[{model}] Respuesta simulada a: {last_user}".split()
+        if max_tokens:
+            words = words[:max_tokens]
+        content = " ".join(words)
+
+        prompt_tokens = sum(_estimate_tokens(m['content']) for m in messages)
+        completion_tokens = len(words)
+        usage = SimpleNamespace(prompt_tokens=prompt_tokens, completion_tokens=completion_tokens,
+                                total_tokens=prompt_tokens + completion_tokens)
+
+        if stream:
+            return _MockStream(words, usage)
+
+        message = SimpleNamespace(role="assistant", content=content)
+        return SimpleNamespace(model=model, choices=[SimpleNamespace(message=message)], usage=usage)
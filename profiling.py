@@ -0,0 +1,130 @@
+"""
+Perfilado bajo demanda de peticiones del chatbot
+Ejecuta la petición bajo cProfile (por cabecera o por muestreo) y guarda los
+perfiles en un buffer circular en disco
+"""
+
+import cProfile
+import os
+import pstats
+import random
+import re
+import threading
+import time
+import uuid
+from io import StringIO
+from typing import List, Dict, Optional
+
+PROFILE_HEADER = "X-Profile"
+
+# Solo se sirven archivos generados por este módulo
+_PROFILE_NAME = re.compile(r"^[0-9]+_[A-Za-z0-9_.-]+_[0-9a-f]{8}\.prof$")
+
+
+class RequestProfiler:
+    """Perfilador de peticiones Flask con buffer circular de archivos .prof"""
+
+    def __init__(self, profile_dir: str = "profiles", max_profiles: int = 50,
+                 sample_rate: float = 0.0, enabled: bool = False):
+        self.profile_dir = profile_dir
+        self.max_profiles = max_profiles
+        self.sample_rate = sample_rate
+        self.enabled = enabled
+        # Un solo perfil activo por proceso: en Python 3.12+ cProfile es global
+        # y un segundo enable() falla con ValueError
+        self._active = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> "RequestProfiler":
+        """Crea el perfilador a partir de las variables de entorno PROFILE_*"""
+        return cls(
+            profile_dir=os.getenv("PROFILE_DIR", "profiles"),
+            max_profiles=int(os.getenv("PROFILE_MAX_FILES", "50")),
+            sample_rate=float(os.getenv("PROFILE_SAMPLE_RATE", "0")),
+            enabled=os.getenv("PROFILE_ENABLED", "0").lower() in ("1", "true", "yes")
+        )
+
+    def should_profile(self, headers, authorized: bool = False) -> bool:
+        """Decide si perfilar la petición: cabecera explícita (solo administradores) o muestreo"""
+        if not self.enabled:
+            return False
+        if authorized and headers.get(PROFILE_HEADER, "").lower() in ("1", "true", "yes"):
+            return True
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    def start(self) -> Optional[cProfile.Profile]:
+        """Activa cProfile si no hay otro perfil en curso (None si no se perfila)
+
+        cProfile es global al proceso en Python 3.12+, así que el perfil puede
+        incluir trabajo de otros hilos que atienden peticiones a la vez.
+        """
+        if not self._active.acquire(blocking=False):
+            return None
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except Exception as e:
+            # Otra herramienta de perfilado activa: la petición sigue sin perfil
+            self._active.release()
+            print(f"Error al activar el perfilador: {e}")
+            return None
+        return profiler
+
+    def stop(self, profiler: cProfile.Profile, endpoint: str, elapsed: float) -> Optional[str]:
+        """Detiene el perfilador, guarda el perfil y recorta el buffer circular"""
+        try:
+            profiler.disable()
+        finally:
+            self._active.release()
+        try:
+            os.makedirs(self.profile_dir, exist_ok=True)
+            safe_endpoint = re.sub(r"[^A-Za-z0-9_.-]", "_", endpoint or "unknown")
+            name = f"{time.time_ns()}_{safe_endpoint}-{int(elapsed * 1000)}ms_{uuid.uuid4().hex[:8]}.prof"
+            profiler.dump_stats(os.path.join(self.profile_dir, name))
+            self._prune()
+            return name
+        except Exception as e:
+            print(f"Error al guardar perfil: {e}")
+            return None
+
+    def _prune(self):
+        """Elimina los perfiles más antiguos por encima de max_profiles"""
+        names = sorted(n for n in os.listdir(self.profile_dir) if _PROFILE_NAME.match(n))
+        for name in names[:max(len(names) - self.max_profiles, 0)]:
+            try:
+                os.remove(os.path.join(self.profile_dir, name))
+            except OSError:
+                pass
+
+    def list_profiles(self) -> List[Dict]:
+        """Lista los perfiles guardados, del más reciente al más antiguo"""
+        if not os.path.isdir(self.profile_dir):
+            return []
+        profiles = []
+        for name in sorted(os.listdir(self.profile_dir), reverse=True):
+            if not _PROFILE_NAME.match(name):
+                continue
+            path = os.path.join(self.profile_dir, name)
+            profiles.append({
+                'name': name,
+                'size_bytes': os.path.getsize(path),
+                'created_at': int(name.split("_", 1)[0]) / 1e9
+            })
+        return profiles
+
+    def profile_path(self, name: str) -> Optional[str]:
+        """Ruta de un perfil guardado, o None si el nombre no es válido"""
+        if not _PROFILE_NAME.match(name):
+            return None
+        path = os.path.join(self.profile_dir, name)
+        return path if os.path.isfile(path) else None
+
+    def render_text(self, name: str, limit: int = 50) -> Optional[str]:
+        """Resumen legible de un perfil ordenado por tiempo acumulado"""
+        path = self.profile_path(name)
+        if not path:
+            return None
+        output = StringIO()
+        stats = pstats.Stats(path, stream=output)
+        stats.sort_stats("cumulative").print_stats(limit)
+        return output.getvalue()
@@ -0,0 +1,265 @@
+"""
+Cuotas de tokens por sesión, por usuario y globales
+Los contadores viven en memoria (ventana deslizante por buckets) y un hilo en
+segundo plano los vuelca periódicamente a SQLite; comprobar una cuota es O(1) y
+no toca la base de datos
+
+La cuota por usuario es orientativa: la aplicación no autentica usuarios y el
+nombre solo se fija al crear la sesión
+"""
+
+import atexit
+import os
+import threading
+import time
+from typing import Dict, Optional
+
+from metrics import QUOTA_DECISIONS
+
+SESSION = "session"
+USER = "user"
+GLOBAL = "global"
+
+
+def estimate_tokens(messages) -> int:
+    """Aproximación barata del tamaño del prompt: ~4 caracteres por token"""
+    return sum(max(len(message['content']) // 4, 1) for message in messages)
+
+
+class SlidingWindowCounter:
+    """Suma de tokens en los últimos `window_seconds` segundos, dividida en buckets"""
+
+    def __init__(self, window_seconds: float, buckets: int = 60):
+        self.bucket_seconds = window_seconds / buckets
+        self.counts = [0] * buckets
+        self.current = None  # índice absoluto del bucket actual
+        self.total = 0
+
+    def _bucket_index(self, now: float) -> int:
+        return int(now // self.bucket_seconds)
+
+    def _advance(self, now: float):
+        """Vacía los buckets que salieron de la ventana (amortizado O(1))"""
+        index = self._bucket_index(now)
+        if self.current is None:
+            self.current = index
+            return
+        steps = index - self.current
+        if steps <= 0:
+            return
+        if steps >= len(self.counts):
+            self.counts = [0] * len(self.counts)
+            self.total = 0
+        else:
+            for offset in range(1, steps + 1):
+                slot = (self.current + offset) % len(self.counts)
+                self.total -= self.counts[slot]
+                self.counts[slot] = 0
+        self.current = index
+
+    def add(self, tokens: int, now: float):
+        self._advance(now)
+        self.counts[self.current % len(self.counts)] += tokens
+        self.total += tokens
+
+    def value(self, now: float) -> int:
+        self._advance(now)
+        return self.total
+
+    def load(self, buckets: Dict[int, int], now: float):
+        """Reemplaza el contenido con buckets {índice absoluto: tokens}"""
+        self.counts = [0] * len(self.counts)
+        self.total = 0
+        self.current = self._bucket_index(now)
+        for index, tokens in buckets.items():
+            if 0 <= self.current - index < len(self.counts):
+                self.counts[index % len(self.counts)] += tokens
+                self.total += tokens
+
+    def seconds_until_release(self, now: float) -> float:
+        """Segundos hasta que el bucket más antiguo con tokens salga de la ventana"""
+        self._advance(now)
+        size = len(self.counts)
+        for age in range(size - 1, -1, -1):
+            if self.counts[(self.current - age) % size]:
+                release_at = (self.current - age + size) * self.bucket_seconds
+                return max(release_at - now, 0)
+        return 0
+
+
+class QuotaManager:
+    """Aplica límites de tokens con contadores en memoria volcados a SQLite"""
+
+    def __init__(self, db=None, session_limit: int = 0, user_limit: int = 0,
+                 global_limit: int = 0, window_seconds: int = 3600,
+                 flush_interval: float = 30, buckets: int = 60):
+        self.db = db
+        # 0 desactiva el límite de ese ámbito
+        self.limits = {SESSION: session_limit, USER: user_limit, GLOBAL: global_limit}
+        self.window_seconds = window_seconds
+        self.flush_interval = flush_interval
+        self.buckets = buckets
+        self.bucket_seconds = window_seconds / buckets
+        self._counters: Dict[tuple, SlidingWindowCounter] = {}
+        self._pending: Dict[tuple, int] = {}
+        self._last_flush = time.time()
+        self._lock = threading.Lock()
+        self._flusher: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self.reload()
+
+    @classmethod
+    def from_env(cls, db=None) -> "QuotaManager":
+        """Crea el gestor a partir de las variables de entorno QUOTA_*"""
+        return cls(
+            db=db,
+            session_limit=int(os.getenv("QUOTA_SESSION_TOKENS", "0")),
+            user_limit=int(os.getenv("QUOTA_USER_TOKENS", "0")),
+            global_limit=int(os.getenv("QUOTA_GLOBAL_TOKENS", "0")),
+            window_seconds=int(os.getenv("QUOTA_WINDOW_SECONDS", "3600")),
+            flush_interval=float(os.getenv("QUOTA_FLUSH_SECONDS", "30"))
+        )
+
+    @property
+    def enabled(self) -> bool:
+        return any(self.limits.values())
+
+    def _keys(self, session_id: str, user_name: Optional[str]):
+        keys = [(SESSION, session_id), (GLOBAL, "*")]
+        if user_name:
+            keys.append((USER, user_name))
+        return [key for key in keys if self.limits[key[0]]]
+
+    def _counter(self, key: tuple) -> SlidingWindowCounter:
+        counter = self._counters.get(key)
+        if counter is None:
+            counter = self._counters[key] = SlidingWindowCounter(self.window_seconds, self.buckets)
+        return counter
+
+    def check(self, session_id: str, user_name: str = None, max_tokens: int = 500,
+              prompt_tokens: int = 0, now: float = None) -> Dict:
+        """Decide antes de llamar a OpenAI: permitir, degradar (menos max_tokens) o rechazar
+
+        Se cobran los tokens totales, así que el prompt estimado se descuenta de
+        lo que queda antes de acotar la respuesta.
+        """
+        decision = {'allowed': True, 'degraded': False, 'max_tokens': max_tokens,
+                     'scope': None, 'remaining': None, 'retry_after': 0}
+        if not self.enabled:
+            return decision
+
+        now = time.time() if now is None else now
+        with self._lock:
+            for key in self._keys(session_id, user_name):
+                counter = self._counter(key)
+                remaining = self.limits[key[0]] - counter.value(now)
+                if decision['remaining'] is None or remaining < decision['remaining']:
+                    decision['remaining'] = remaining
+                    decision['scope'] = key[0]
+                    if remaining <= prompt_tokens:
+                        decision['retry_after'] = counter.seconds_until_release(now)
+
+        remaining = decision['remaining']
+        budget = None if remaining is None else remaining - prompt_tokens
+        if budget is not None and budget <= 0:
+            decision['allowed'] = False
+            decision['max_tokens'] = 0
+            QUOTA_DECISIONS.inc(result="rejected", scope=decision['scope'])
+        elif budget is not None and budget < max_tokens:
+            # Cerca del límite: la respuesta se acota a lo que queda tras el prompt
+            decision['degraded'] = True
+            decision['max_tokens'] = budget
+            QUOTA_DECISIONS.inc(result="degraded", scope=decision['scope'])
+        else:
+            QUOTA_DECISIONS.inc(result="allowed", scope=decision['scope'] or "")
+        return decision
+
+    def record(self, session_id: str, user_name: str = None, tokens: int = 0, now: float = None):
+        """Suma los tokens consumidos; sin hilo de volcado, vuelca a SQLite si toca"""
+        if not self.enabled or not tokens:
+            return
+
+        now = time.time() if now is None else now
+        bucket_start = int(now // self.bucket_seconds * self.bucket_seconds)
+        with self._lock:
+            for key in self._keys(session_id, user_name):
+                self._counter(key).add(tokens, now)
+                pending_key = (key[0], key[1], bucket_start)
+                self._pending[pending_key] = self._pending.get(pending_key, 0) + tokens
+            due = self._flusher is None and now - self._last_flush >= self.flush_interval
+
+        if due:
+            self.flush(now)
+
+    def flush(self, now: float = None):
+        """Vuelca los tokens pendientes y recarga los contadores (incluye otros workers)"""
+        now = time.time() if now is None else now
+        with self._lock:
+            pending = self._pending
+            self._pending = {}
+            self._last_flush = now
+
+        if self.db is None:
+            return
+        if pending and not self.db.add_token_usage(
+                [(scope, key, bucket_start, tokens) for (scope, key, bucket_start), tokens in pending.items()]):
+            # Reintentar en el próximo volcado
+            with self._lock:
+                for pending_key, tokens in pending.items():
+                    self._pending[pending_key] = self._pending.get(pending_key, 0) + tokens
+            return
+        # Los buckets fuera de la ventana ya no cuentan para ninguna cuota
+        self.db.prune_token_usage(int(now - self.window_seconds))
+        self.reload(now)
+
+    def reload(self, now: float = None):
+        """Reconstruye los contadores desde SQLite para la ventana actual"""
+        if self.db is None or not self.enabled:
+            return
+
+        now = time.time() if now is None else now
+        buckets: Dict[tuple, Dict[int, int]] = {}
+        for scope, key, bucket_start, tokens in self.db.get_token_usage(int(now - self.window_seconds)):
+            index = int(bucket_start // self.bucket_seconds)
+            per_key = buckets.setdefault((scope, key), {})
+            per_key[index] = per_key.get(index, 0) + tokens
+
+        with self._lock:
+            # Los tokens aún sin volcar se suman encima de lo leído
+            for (scope, key, bucket_start), tokens in self._pending.items():
+                index = int(bucket_start // self.bucket_seconds)
+                per_key = buckets.setdefault((scope, key), {})
+                per_key[index] = per_key.get(index, 0) + tokens
+            for key in set(self._counters) | set(buckets):
+                self._counter(key).load(buckets.get(key, {}), now)
+                # Olvidar los contadores que ya no tienen tokens en la ventana
+                if not self._counters[key].total:
+                    del self._counters[key]
+
+    def start_background_flush(self):
+        """Arranca el hilo que vuelca y recarga los contadores fuera de las peticiones"""
+        if self._flusher is not None or not self.enabled:
+            return
+        self._stop.clear()
+        self._flusher = threading.Thread(target=self._flush_loop, name="quota-flush", daemon=True)
+        self._flusher.start()
+
+    def _flush_loop(self):
+        while not self._stop.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Error al volcar cuotas: {e}")
+
+    def stop_background_flush(self):
+        """Detiene el hilo de volcado y vuelca lo pendiente"""
+        flusher = self._flusher
+        if flusher is not None:
+            self._stop.set()
+            flusher.join()
+            self._flusher = None
+        self.flush()
+
+    def register_exit_flush(self):
+        """Vuelca los contadores pendientes al terminar el proceso"""
+        atexit.register(self.stop_background_flush)
@@ -0,0 +1,180 @@
+"""
+Enrutado de peticiones de chat por latencia y coste
+Clasifica cada turno con rasgos locales baratos (longitud, profundidad, palabras
+clave) y elige, entre las rutas candidatas de su categoría, la que mejor
+latencia y coste ha mostrado; las observaciones se guardan en SQLite
+"""
+
+import json
+import os
+import random
+import re
+import threading
+import time
+from typing import Dict, List
+
+SMALL_TALK = "small_talk"
+GENERAL = "general"
+COMPLEX = "complex"
+
+# Rutas: modelo, max_tokens y coste aproximado por 1k tokens (USD)
+DEFAULT_ROUTES = {
+    "fast": {"model": "gpt-4o-mini", "max_tokens": 150, "cost_per_1k_tokens": 0.0006},
+    "short": {"model": "gpt-3.5-turbo", "max_tokens": 150, "cost_per_1k_tokens": 0.0015},
+    "standard": {"model": "gpt-3.5-turbo", "max_tokens": 500, "cost_per_1k_tokens": 0.0015},
+    "extended": {"model": "gpt-4o-mini", "max_tokens": 1000, "cost_per_1k_tokens": 0.0006},
+}
+
+# Rutas candidatas por categoría, de la preferida por defecto a la alternativa
+DEFAULT_CATEGORIES = {
+    SMALL_TALK: ["fast", "short"],
+    GENERAL: ["standard", "extended"],
+    COMPLEX: ["extended", "standard"],
+}
+
+_SMALL_TALK_PATTERN = re.compile(
+    r"^\W*(hola|buenas|buenos d[ií]as|buenas tardes|buenas noches|hey|hi|hello|gracias|"
+    r"muchas gracias|thanks|ok|vale|genial|perfecto|jaja+|adi[oó]s|chao|bye|"
+    r"qu[eé] tal|c[oó]mo est[aá]s)\b",
+    re.IGNORECASE
+)
+_COMPLEX_PATTERN = re.compile(
+    r"```|\btraceback\b|\berror\b|\bexception\b|\bdef |\bclass |\bSELECT\b|"
+    r"\bexpl[ií]ca(me)?\b|\bexplain\b|\bcompara\b|\bcompare\b|\banaliza\b|\banalyze\b|"
+    r"\bpaso a paso\b|\bstep by step\b|\bdemuestra\b|\bprove\b",
+    re.IGNORECASE
+)
+
+
+def classify_message(message: str, depth: int = 0) -> str:
+    """Clasificador ligero: small_talk, general o complex"""
+    length = len(message)
+    if length > 600 or _COMPLEX_PATTERN.search(message):
+        return COMPLEX
+    if length <= 80 and _SMALL_TALK_PATTERN.search(message):
+        return SMALL_TALK
+    if length <= 20 and "?" not in message:
+        return SMALL_TALK
+    if depth > 30 and length > 200:
+        return COMPLEX
+    return GENERAL
+
+
+class ModelRouter:
+    """Elige modelo y max_tokens por petición y adapta la tabla con lo observado"""
+
+    def __init__(self, db=None, routes: Dict = None, categories: Dict = None,
+                 epsilon: float = 0.05, min_samples: int = 3, latency_weight: float = 1.0,
+                 cost_weight: float = 1.0, refresh_seconds: float = 60):
+        self.db = db
+        self.routes = routes or DEFAULT_ROUTES
+        self.categories = categories or DEFAULT_CATEGORIES
+        self._validate()
+        self.epsilon = epsilon
+        self.min_samples = min_samples
+        self.latency_weight = latency_weight
+        self.cost_weight = cost_weight
+        self.refresh_seconds = refresh_seconds
+        # (ruta, categoría) -> {'requests', 'ewma_latency', 'ewma_tokens'}
+        self._stats: Dict[tuple, Dict] = {}
+        self._last_refresh = 0.0
+        self._lock = threading.Lock()
+        self.refresh()
+
+    @classmethod
+    def from_env(cls, db=None) -> "ModelRouter":
+        """Configuración desde ROUTING_CONFIG (JSON con 'routes' y 'categories') y ROUTING_*"""
+        config = json.loads(os.getenv("ROUTING_CONFIG", "{}"))
+        return cls(
+            db=db,
+            routes=config.get("routes"),
+            categories=config.get("categories"),
+            epsilon=float(os.getenv("ROUTING_EPSILON", "0.05")),
+            latency_weight=float(os.getenv("ROUTING_LATENCY_WEIGHT", "1")),
+            cost_weight=float(os.getenv("ROUTING_COST_WEIGHT", "1")),
+            refresh_seconds=float(os.getenv("ROUTING_REFRESH_SECONDS", "60"))
+        )
+
+    def _validate(self):
+        """Cada categoría del clasificador necesita al menos una ruta existente"""
+        for category in (SMALL_TALK, GENERAL, COMPLEX):
+            candidates = [name for name in self.categories.get(category, []) if name in self.routes]
+            if not candidates:
+                raise ValueError(f"La categoría {category} no tiene ninguna ruta definida en routes")
+
+    def refresh(self):
+        """Recarga las estadísticas de rutas guardadas (incluye las de otros workers)"""
+        self._last_refresh = time.monotonic()
+        if self.db is None:
+            return
+        stats = {
+            (row['route'], row['category']): row
+            for row in self.db.get_route_stats()
+        }
+        with self._lock:
+            self._stats = stats
+
+    def _cost(self, route_name: str, tokens: float) -> float:
+        return tokens * self.routes[route_name]["cost_per_1k_tokens"] / 1000
+
+    def _choose(self, category: str) -> str:
+        candidates = [name for name in self.categories[category] if name in self.routes]
+        with self._lock:
+            stats = {name: self._stats.get((name, category)) for name in candidates}
+
+        # Explorar primero las rutas con pocas observaciones
+        unexplored = [name for name in candidates
+                      if not stats[name] or stats[name]['requests'] < self.min_samples]
+        if unexplored:
+            return min(unexplored, key=lambda name: stats[name]['requests'] if stats[name] else 0)
+        if random.random() < self.epsilon:
+            return random.choice(candidates)
+
+        # Puntuación relativa a la mejor latencia y al menor coste de la categoría
+        latencies = {name: stats[name]['ewma_latency'] for name in candidates}
+        costs = {name: self._cost(name, stats[name]['ewma_tokens']) for name in candidates}
+        best_latency = min(latencies.values()) or 1e-9
+        best_cost = min(costs.values()) or 1e-9
+        return min(candidates, key=lambda name: (
+            self.latency_weight * latencies[name] / best_latency
+            + self.cost_weight * costs[name] / best_cost
+        ))
+
+    def route(self, message: str, depth: int = 0) -> Dict:
+        """Devuelve la ruta elegida: {'route', 'category', 'model', 'max_tokens'}"""
+        if time.monotonic() - self._last_refresh >= self.refresh_seconds:
+            self.refresh()
+
+        category = classify_message(message, depth)
+        name = self._choose(category)
+        route = self.routes[name]
+        return {
+            'route': name,
+            'category': category,
+            'model': route["model"],
+            'max_tokens': route["max_tokens"]
+        }
+
+    def record(self, decision: Dict, latency: float, tokens: int, alpha: float = 0.2):
+        """Registra la latencia y los tokens observados para la ruta usada"""
+        key = (decision['route'], decision['category'])
+        with self._lock:
+            stats = self._stats.get(key)
+            if stats is None:
+                stats = self._stats[key] = {
+                    'route': key[0], 'category': key[1], 'requests': 0,
+                    'ewma_latency': latency, 'ewma_tokens': float(tokens)
+                }
+            else:
+                stats['ewma_latency'] += alpha * (latency - stats['ewma_latency'])
+                stats['ewma_tokens'] += alpha * (tokens - stats['ewma_tokens'])
+            stats['requests'] += 1
+
+        if self.db is not None:
+            self.db.record_route_stats(key[0], key[1], latency, tokens,
+                                       self._cost(key[0], tokens), alpha)
+
+    def get_table(self) -> List[Dict]:
+        """Tabla de rutas actual con sus estadísticas (para inspección)"""
+        with self._lock:
+            return [dict(stats) for stats in self._stats.values()]
@@ -8,20 +8,41 @@ const loadingIndicator = document.getElementById('loadingIndicator');
 // Estado de la aplicación
 let isLoading = false;
 
-// Función para formatear el tiempo
-function formatTime() {
-    const now = new Date();
-    return now.toLocaleTimeString('es-ES', { 
-        hour: '2-digit', 
-        minute: '2-digit' 
-    });
-}
+// Lista virtualizada: solo se montan en el DOM los mensajes visibles
+const MESSAGE_GAP = 20;          // separación entre mensajes (px)
+const ESTIMATED_HEIGHT = 96;     // altura estimada antes de medir (px)
+const OVERSCAN_PX = 600;         // margen montado por encima y por debajo de la vista
+const STICK_THRESHOLD = 80;      // distancia al final para seguir auto-scrolleando
 
-// Función para crear un mensaje en el chat
-function createMessage(text, isUser = false) {
-    const messageDiv = document.createElement('div');
-    messageDiv.className = `message ${isUser ? 'user-message' : 'bot-message'}`;
-    
+const messageStore = [];         // { text, isUser, time, animate }
+const heights = [];              // altura medida de cada mensaje (incluye separación)
+const offsets = [0];             // offsets[i] = posición superior del mensaje i
+let dirtyFrom = 0;               // primer índice cuyo offset hay que recalcular
+const mounted = new Map();       // índice -> nodo montado
+const nodePool = { user: [], bot: [] };
+let renderScheduled = false;
+let stickToBottom = true;
+let pendingAppends = 0;
+let historyGeneration = 0;       // cambia al limpiar: descarta páginas de historial en vuelo
+
+const messageList = document.createElement('div');
+messageList.className = 'message-list';
+const topSpacer = document.createElement('div');
+const itemsContainer = document.createElement('div');
+const bottomSpacer = document.createElement('div');
+topSpacer.className = bottomSpacer.className = 'message-spacer';
+itemsContainer.className = 'message-items';
+messageList.append(topSpacer, itemsContainer, bottomSpacer);
+chatMessages.appendChild(messageList);
+
+// Plantillas clonadas en lugar de reconstruir el HTML y el SVG en cada mensaje
+const messageTemplates = {
+    user: buildMessageTemplate(true),
+    bot: buildMessageTemplate(false)
+};
+
+function buildMessageTemplate(isUser) {
+    const template = document.createElement('template');
     const avatarSVG = isUser 
         ? `<svg width="20" height="20" viewBox="0 0 24 24" fill="none" xmlns="http://www.w3.org/2000/svg">
              <path d="M20 21v-2a4 4 0 00-4-4H8a4 4 0 00-4 4v2M12 11a4 4 0 100-8 4 4 0 000 8z" stroke="currentColor" stroke-width="2" stroke-linecap="round" stroke-linejoin="round"/>
@@ -31,35 +52,239 @@ function createMessage(text, isUser = false) {
              <path d="M8 14s1.5 2 4 2 4-2 4-2M9 9h.01M15 9h.01" stroke="currentColor" stroke-width="2" stroke-linecap="round"/>
            </svg>`;
     
-    messageDiv.innerHTML = `
-        <div class="message-avatar">
-            ${avatarSVG}
-        </div>
-        <div class="message-content">
-            <div class="message-bubble">
-                <p class="message-text">${escapeHtml(text)}</p>
+    template.innerHTML = `
+        <div class="message ${isUser ? 'user-message' : 'bot-message'}">
+            <div class="message-avatar">${avatarSVG}</div>
+            <div class="message-content">
+                <div class="message-bubble">
+                    <p class="message-text"></p>
+                </div>
+                <span class="message-time"></span>
             </div>
-            <span class="message-time">${formatTime()}</span>
         </div>
-    `;
+    `.trim();
+    return template;
+}
+
+// Función para formatear el tiempo
+function formatTime(date = new Date()) {
+    return date.toLocaleTimeString('es-ES', { 
+        hour: '2-digit', 
+        minute: '2-digit' 
+    });
+}
+
+// Función para crear (o reutilizar) el nodo de un mensaje
+function createMessage(item) {
+    const kind = item.isUser ? 'user' : 'bot';
+    const messageDiv = nodePool[kind].pop()
+        || messageTemplates[kind].content.firstElementChild.cloneNode(true);
+    
+    messageDiv.querySelector('.message-text').textContent = item.text;
+    messageDiv.querySelector('.message-time').textContent = item.time;
+    // Solo los mensajes nuevos se animan; al re-montar por scroll no
+    messageDiv.classList.toggle('no-animation', !item.animate);
+    item.animate = false;
     
     return messageDiv;
 }
 
-// Función para agregar mensaje al chat
-function addMessage(text, isUser = false) {
-    const messageElement = createMessage(text, isUser);
-    chatMessages.appendChild(messageElement);
+// Función para agregar mensaje al chat (se renderiza en el siguiente frame)
+function addMessage(text, isUser = false, time = formatTime()) {
+    messageStore.push({ text, isUser, time, animate: true });
+    heights.push(ESTIMATED_HEIGHT);
+    pendingAppends++;
+    scheduleRender();
+    return messageStore.length - 1;
+}
+
+// Función para vaciar la lista de mensajes
+function resetMessages() {
+    historyGeneration++;
+    messageStore.length = 0;
+    heights.length = 0;
+    offsets.length = 1;
+    dirtyFrom = 0;
+    mounted.forEach(node => node.remove());
+    mounted.clear();
+    nodePool.user.length = 0;
+    nodePool.bot.length = 0;
+    stickToBottom = true;
+    scheduleRender();
+}
+
+function scheduleRender() {
+    if (!renderScheduled) {
+        renderScheduled = true;
+        requestAnimationFrame(renderMessages);
+    }
+}
+
+// Recalcula los offsets a partir del primer mensaje modificado
+function updateOffsets() {
+    for (let i = dirtyFrom; i < heights.length; i++) {
+        offsets[i + 1] = offsets[i] + heights[i];
+    }
+    offsets.length = heights.length + 1;
+    dirtyFrom = heights.length;
+}
+
+// Búsqueda binaria del mensaje que contiene la posición y
+function findIndex(y) {
+    let low = 0;
+    let high = heights.length - 1;
+    while (low < high) {
+        const mid = (low + high + 1) >> 1;
+        if (offsets[mid] <= y) {
+            low = mid;
+        } else {
+            high = mid - 1;
+        }
+    }
+    return Math.max(low, 0);
+}
+
+function updateSpacers(start, end) {
+    topSpacer.style.height = `${offsets[start]}px`;
+    bottomSpacer.style.height = `${offsets[heights.length] - offsets[end]}px`;
+}
+
+// Monta los mensajes visibles, desmonta el resto y mide alturas (una vez por frame)
+function renderMessages() {
+    renderScheduled = false;
+    const appended = pendingAppends;
+    pendingAppends = 0;
+    updateOffsets();
+    
+    if (heights.length === 0) {
+        updateSpacers(0, 0);
+        return;
+    }
+    
+    const viewTop = stickToBottom
+        ? offsets[heights.length] - chatMessages.clientHeight
+        : chatMessages.scrollTop - messageList.offsetTop;
+    const viewBottom = viewTop + chatMessages.clientHeight;
+    const start = findIndex(viewTop - OVERSCAN_PX);
+    const end = Math.min(findIndex(viewBottom + OVERSCAN_PX) + 1, heights.length);
+    
+    // Desmontar los que salieron del rango y devolverlos al pool
+    mounted.forEach((node, index) => {
+        if (index < start || index >= end) {
+            node.remove();
+            nodePool[messageStore[index]?.isUser ? 'user' : 'bot'].push(node);
+            mounted.delete(index);
+        }
+    });
     
-    // Scroll suave al final
-    requestAnimationFrame(() => {
+    // Montar en orden los que faltan
+    let next = itemsContainer.firstChild;
+    for (let i = start; i < end; i++) {
+        let node = mounted.get(i);
+        if (!node) {
+            node = createMessage(messageStore[i]);
+            mounted.set(i, node);
+        }
+        if (node !== next) {
+            itemsContainer.insertBefore(node, next);
+        } else {
+            next = next.nextSibling;
+        }
+    }
+    
+    // Medir los nodos montados y corregir las alturas estimadas
+    for (let i = start; i < end; i++) {
+        const height = mounted.get(i).offsetHeight + MESSAGE_GAP;
+        if (height !== heights[i]) {
+            heights[i] = height;
+            dirtyFrom = Math.min(dirtyFrom, i);
+        }
+    }
+    updateOffsets();
+    updateSpacers(start, end);
+    
+    if (stickToBottom) {
+        // Un mensaje nuevo se desplaza suave; una carga masiva salta directamente
         chatMessages.scrollTo({
             top: chatMessages.scrollHeight,
-            behavior: 'smooth'
+            behavior: appended === 1 ? 'smooth' : 'auto'
         });
+    }
+}
+
+chatMessages.addEventListener('scroll', () => {
+    const distance = chatMessages.scrollHeight - chatMessages.scrollTop - chatMessages.clientHeight;
+    stickToBottom = distance < STICK_THRESHOLD;
+    scheduleRender();
+}, { passive: true });
+
+window.addEventListener('resize', () => {
+    // El ancho cambia el alto de los mensajes: volver a medir lo montado
+    scheduleRender();
+});
+
+// Restaurar la conversación guardada de la sesión actual: primero la página
+// más reciente y después, hacia atrás, el resto hasta el principio
+const HISTORY_PAGE = 500;
+
+function historyItems(history) {
+    return history.map(msg => ({
+        text: msg.content,
+        isUser: msg.role === 'user',
+        time: msg.timestamp
+            ? formatTime(new Date(msg.timestamp.replace(' ', 'T') + 'Z'))
+            : formatTime(),
+        animate: false
+    }));
+}
+
+// Inserta mensajes antiguos al principio conservando la posición de lectura
+function prependMessages(items) {
+    if (items.length === 0) return;
+    messageStore.unshift(...items);
+    heights.unshift(...items.map(() => ESTIMATED_HEIGHT));
+    // Los índices montados cambian: devolver los nodos al pool y volver a montar
+    mounted.forEach((node, index) => {
+        node.remove();
+        nodePool[messageStore[index + items.length].isUser ? 'user' : 'bot'].push(node);
     });
-    
-    return messageElement;
+    mounted.clear();
+    dirtyFrom = 0;
+    if (!stickToBottom) {
+        chatMessages.scrollTop += items.length * ESTIMATED_HEIGHT;
+    }
+    scheduleRender();
+}
+
+async function fetchHistoryPage(before) {
+    const params = new URLSearchParams({ limit: HISTORY_PAGE });
+    if (before !== undefined) params.set('before', before);
+    const response = await fetch(`/history?${params}`);
+    if (!response.ok) return null;
+    return response.json();
+}
+
+async function loadHistory() {
+    const generation = historyGeneration;
+    try {
+        let page = await fetchHistoryPage();
+        if (!page || generation !== historyGeneration) return;
+        
+        for (const item of historyItems(page.history || [])) {
+            messageStore.push(item);
+            heights.push(ESTIMATED_HEIGHT);
+        }
+        stickToBottom = true;
+        scheduleRender();
+        
+        while (page.start > 0) {
+            page = await fetchHistoryPage(page.start);
+            if (!page || generation !== historyGeneration) return;
+            prependMessages(historyItems(page.history || []));
+        }
+    } catch (error) {
+        console.error('Error al cargar historial:', error);
+    }
 }
 
 // Función para enviar mensaje
@@ -68,7 +293,8 @@ async function sendMessage() {
     
     if (!message || isLoading) return;
     
-    // Agregar mensaje del usuario
+    // Agregar mensaje del usuario (y seguir el final de la conversación)
+    stickToBottom = true;
     addMessage(message, true);
     
     // Limpiar input
@@ -138,11 +364,13 @@ async function clearConversation() {
         });
         
         if (response.ok) {
-            // Limpiar mensajes del DOM
-            chatMessages.innerHTML = '';
+            // Limpiar mensajes (el mensaje de bienvenida estático se conserva)
+            resetMessages();
             
-            // Agregar mensaje de bienvenida
-            addMessage('¡Hola! 👋 Soy tu asistente AI. ¿En qué puedo ayudarte hoy?', false);
+            const welcomeTime = document.querySelector('.message-time');
+            if (welcomeTime) {
+                welcomeTime.textContent = formatTime();
+            }
         }
     } catch (error) {
         console.error('Error al limpiar conversación:', error);
@@ -186,6 +414,7 @@ function formatMessage(text) {
 // Inicialización
 document.addEventListener('DOMContentLoaded', () => {
     messageInput.focus();
+    loadHistory();
     
     // Establecer el tiempo inicial en el mensaje de bienvenida
     const welcomeTime = document.querySelector('.message-time');
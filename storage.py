@@ -0,0 +1,126 @@
+"""
+Motores de almacenamiento para DatabaseManager
+Permite usar el archivo SQLite de siempre o una base de datos en memoria compartida
+"""
+
+import os
+import shutil
+import sqlite3
+import threading
+import uuid
+
+from metrics import InstrumentedConnection
+
+# El VFS memdb permite varias conexiones a la misma base en memoria con el
+# bloqueo normal de SQLite; en versiones antiguas se usa la caché compartida
+_HAS_MEMDB = sqlite3.sqlite_version_info >= (3, 36, 0)
+
+MEMORY_PREFIX = "memory://"
+
+
+class StorageEngine:
+    """Interfaz de almacenamiento sobre la que se apoya DatabaseManager"""
+
+    name = "base"
+    # Identifica la base de datos concreta (p. ej. para los espacios de nombres de caché)
+    identity = None
+
+    def connect(self) -> sqlite3.Connection:
+        """Abre una nueva conexión a la base de datos"""
+        raise NotImplementedError
+
+    def exists(self) -> bool:
+        """Indica si la base de datos ya existe"""
+        raise NotImplementedError
+
+    def backup(self, backup_path: str):
+        """Copia la base de datos completa a un archivo"""
+        source = self.connect()
+        target = sqlite3.connect(backup_path)
+        try:
+            source.backup(target)
+        finally:
+            target.close()
+            source.close()
+
+    def close(self):
+        """Libera los recursos del motor"""
+        pass
+
+
+class SQLiteFileEngine(StorageEngine):
+    """Base de datos SQLite en un archivo (comportamiento original)"""
+
+    name = "sqlite"
+
+    def __init__(self, path: str):
+        self.path = path
+        self.identity = f"sqlite:{os.path.abspath(path)}"
+
+    def connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path, factory=InstrumentedConnection)
+
+    def exists(self) -> bool:
+        return os.path.exists(self.path)
+
+    def backup(self, backup_path: str):
+        shutil.copy2(self.path, backup_path)
+
+
+class SQLiteMemoryEngine(StorageEngine):
+    """Base de datos SQLite en memoria compartida entre conexiones del proceso"""
+
+    name = "memory"
+
+    def __init__(self, name: str = None):
+        self.memory_name = name or uuid.uuid4().hex
+        # Una base con el mismo nombre recreada tras close() es otra base: id por instancia
+        self.identity = f"memory:{self.memory_name}:{uuid.uuid4().hex}"
+        if _HAS_MEMDB:
+            self.uri = f"file:/{self.memory_name}?vfs=memdb"
+        else:
+            self.uri = f"file:{self.memory_name}?mode=memory&cache=shared"
+        # La base en memoria existe mientras quede al menos una conexión abierta
+        self._anchor = self.connect()
+
+    def connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.uri, uri=True, factory=InstrumentedConnection,
+                               check_same_thread=False)
+
+    def exists(self) -> bool:
+        return self._anchor is not None
+
+    def close(self):
+        if self._anchor is not None:
+            self._anchor.close()
+            self._anchor = None
+        with _memory_engines_lock:
+            if _memory_engines.get(self.memory_name) is self:
+                del _memory_engines[self.memory_name]
+
+
+_memory_engines = {}
+_memory_engines_lock = threading.Lock()
+
+
+def create_engine(target) -> StorageEngine:
+    """Crea el motor indicado por una ruta, ':memory:' o 'memory://<nombre>'
+
+    Los motores en memoria con el mismo nombre se comparten dentro del proceso,
+    así varias instancias de DatabaseManager ven los mismos datos.
+    """
+    if isinstance(target, StorageEngine):
+        return target
+
+    if target == ":memory:":
+        return SQLiteMemoryEngine()
+
+    if target.startswith(MEMORY_PREFIX):
+        name = target[len(MEMORY_PREFIX):] or "default"
+        with _memory_engines_lock:
+            engine = _memory_engines.get(name)
+            if engine is None:
+                engine = _memory_engines[name] = SQLiteMemoryEngine(name)
+            return engine
+
+    return SQLiteFileEngine(target)
@@ -0,0 +1,122 @@
+import os
+import tempfile
+
+# Proveedor simulado y base en memoria antes de importar la aplicación
+os.environ["OPENAI_PROVIDER"] = "mock"
+os.environ["CHATBOT_DB"] = "memory://app_test"
+os.environ["ADMIN_TOKEN"] = "token_de_prueba"
+
+import app as chatbot_app
+from profiling import RequestProfiler
+from quotas import QuotaManager
+from routing import COMPLEX, GENERAL, ModelRouter
+
+ADMIN_HEADERS = {"X-Admin-Token": "token_de_prueba"}
+
+def test_profiling_requires_admin():
+    """X-Profile solo se atiende con token de administración y nunca tumba la petición"""
+    print("\n🔬 PRUEBA DE PERFILADO")
+    print("=" * 30)
+    
+    with tempfile.TemporaryDirectory() as profile_dir:
+        chatbot_app.profiler = RequestProfiler(profile_dir=profile_dir, enabled=True)
+        client = chatbot_app.app.test_client()
+        
+        assert client.get("/metrics", headers={"X-Profile": "1"}).status_code == 200
+        assert chatbot_app.profiler.list_profiles() == []
+        print("✅ X-Profile anónimo ignorado")
+        
+        assert client.get("/metrics", headers={"X-Profile": "1", **ADMIN_HEADERS}).status_code == 200
+        assert len(chatbot_app.profiler.list_profiles()) == 1
+        print("✅ X-Profile con token de administración perfilado")
+        
+        # Con un perfil en curso, otra petición se atiende sin perfilar
+        active = chatbot_app.profiler.start()
+        try:
+            assert chatbot_app.profiler.start() is None
+            assert client.get("/metrics", headers={"X-Profile": "1", **ADMIN_HEADERS}).status_code == 200
+        finally:
+            chatbot_app.profiler.stop(active, "test", 0)
+        assert len(chatbot_app.profiler.list_profiles()) == 2
+        print("✅ Perfiles concurrentes omitidos sin error")
+        
+        chatbot_app.profiler = RequestProfiler()
+
+def test_user_name_fixed_at_session_creation():
+    """El nombre de usuario de la cuota solo se toma al crear la sesión"""
+    print("\n🪪 PRUEBA DE NOMBRE DE USUARIO")
+    print("=" * 30)
+    
+    client = chatbot_app.app.test_client()
+    assert client.post("/chat", json={"message": "hola", "user_name": "ana"}).status_code == 200
+    assert client.post("/chat", json={"message": "hola otra vez", "user_name": "ben"}).status_code == 200
+    with client.session_transaction() as cookie:
+        assert cookie["user_name"] == "ana"
+    print("✅ El nombre no cambia después de crear la sesión")
+    
+    for invalid in (["ana"], {"nombre": "ana"}, 42, "", "   ", "x" * 65):
+        client = chatbot_app.app.test_client()
+        assert client.post("/chat", json={"message": "hola", "user_name": invalid}).status_code == 400
+        with client.session_transaction() as cookie:
+            assert "session_id" not in cookie
+    print("✅ Nombres que no son texto acotado rechazados con 400")
+
+def test_chat_routing():
+    """/chat envía el max_tokens de la ruta y enruta por la profundidad real de la conversación"""
+    print("\n🧭 PRUEBA DE ENRUTADO EN /chat")
+    print("=" * 30)
+    
+    mock = chatbot_app.get_client()
+    chatbot_app._router = ModelRouter(None, epsilon=0)
+    chatbot_app._quotas = QuotaManager(chatbot_app.get_db(), session_limit=100000)
+    try:
+        client = chatbot_app.app.test_client()
+        
+        # complex empieza por la ruta extended (1000 tokens) y la cuota no la recorta
+        response = client.post("/chat", json={"message": "Explícame paso a paso los índices B-tree"})
+        assert response.status_code == 200
+        assert mock.calls[-1] == {'model': 'gpt-4o-mini', 'max_tokens': 1000, 'messages': 2}
+        print("✅ La ruta extended sale con max_tokens=1000")
+        
+        # Mensaje largo al principio de la conversación: general
+        long_message = "Cuéntame más sobre la historia de Roma " * 6
+        client = chatbot_app.app.test_client()
+        client.post("/chat", json={"message": long_message})
+        categories = {stats['category'] for stats in chatbot_app._router.get_table()}
+        assert GENERAL in categories
+        
+        # Pasada la ventana de contexto, la profundidad sigue contando
+        for i in range(16):
+            assert client.post("/chat", json={"message": f"¿Y qué pasó en el año {i}?"}).status_code == 200
+        before = {(s['route'], s['category']): s['requests'] for s in chatbot_app._router.get_table()}
+        client.post("/chat", json={"message": long_message})
+        after = {(s['route'], s['category']): s['requests'] for s in chatbot_app._router.get_table()}
+        assert sum(after.get(key, 0) - before.get(key, 0) for key in after if key[1] == COMPLEX) == 1
+        print("✅ Conversación profunda enrutada como complex")
+    finally:
+        chatbot_app._router = None
+        chatbot_app._quotas = None
+
+def test_usage_parameters():
+    """/usage acepta fechas con y sin zona y responde 400 a parámetros no válidos"""
+    print("\n📈 PRUEBA DE /usage")
+    print("=" * 30)
+    
+    client = chatbot_app.app.test_client()
+    assert client.get("/usage?start=2024-05-01T00:00:00Z").status_code == 200
+    assert client.get("/usage?start=2024-05-01T00:00:00Z&end=2024-05-02T00:00:00").status_code == 200
+    assert client.get("/usage?start=2024-05-02T00:00:00&end=2024-05-01T00:00:00Z").status_code == 400
+    assert client.get("/usage?start=ayer").status_code == 400
+    
+    # Rango de milenios por horas con points fuera de [1, 2000]: respuesta acotada
+    for points in ("0", "-5", "1000000"):
+        response = client.get(f"/usage?start=0001-01-01T00:00:00&end=9999-01-01T00:00:00&period=hourly&points={points}")
+        assert response.status_code == 200
+        assert 1 <= len(response.get_json()['series']) <= 2000
+    print("✅ Zonas horarias mezcladas sin errores 500")
+
+if __name__ == "__main__":
+    test_profiling_requires_admin()
+    test_user_name_fixed_at_session_creation()
+    test_chat_routing()
+    test_usage_parameters()
@@ -0,0 +1,69 @@
+import os
+import time
+from cache import LocalCache, SQLiteCache, TieredCache
+
+def test_local_cache():
+    """Prueba de la caché local LRU con expiración"""
+    print("\n🗃️ PRUEBA DE CACHÉ LOCAL")
+    print("=" * 30)
+    
+    cache = LocalCache(max_entries=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+    assert cache.get("b") is None  # expulsado por LRU
+    assert cache.get("a") == 1 and cache.get("c") == 3
+    
+    cache.set("ttl", "x", ttl=0.01)
+    time.sleep(0.02)
+    assert cache.get("ttl", "expirado") == "expirado"
+    print("✅ LRU y expiración correctas")
+
+def test_shared_cache():
+    """Prueba de la caché compartida entre procesos y de la caché por niveles"""
+    print("\n🔗 PRUEBA DE CACHÉ COMPARTIDA")
+    print("=" * 30)
+    
+    try:
+        # Dos instancias sobre el mismo archivo simulan dos workers
+        worker_1 = TieredCache(SQLiteCache("cache_test.db", "prompts"), local_ttl=60)
+        worker_2 = TieredCache(SQLiteCache("cache_test.db", "prompts"), local_ttl=60)
+        
+        worker_1.set("saludo", {"content": "hola"})
+        assert worker_2.get("saludo") == {"content": "hola"}
+        print("✅ Valor visible desde otro worker")
+        
+        # Los espacios de nombres no se mezclan
+        assert SQLiteCache("cache_test.db", "quotas").get("saludo") is None
+        
+        worker_1.delete("saludo")
+        assert worker_1.shared.get("saludo") is None
+        print("✅ Espacios de nombres y borrado correctos")
+        
+        # El esquema se crea una vez por proceso y archivo, y se recrea si el archivo desaparece
+        created = []
+        original = SQLiteCache._create_schema
+        SQLiteCache._create_schema = lambda self: created.append(self.path) or original(self)
+        try:
+            SQLiteCache("cache_test.db", "otra")
+            assert created == []
+            for suffix in ("", "-wal", "-shm"):
+                if os.path.exists("cache_test.db" + suffix):
+                    os.remove("cache_test.db" + suffix)
+            worker_1.set("saludo", "de nuevo")
+            assert worker_2.shared.get("saludo") == "de nuevo"
+            assert created == ["cache_test.db"]
+        finally:
+            SQLiteCache._create_schema = original
+        print("✅ Esquema creado una sola vez por archivo")
+    finally:
+        for suffix in ("", "-wal", "-shm"):
+            try:
+                os.remove("cache_test.db" + suffix)
+            except:
+                pass
+
+if __name__ == "__main__":
+    test_local_cache()
+    test_shared_cache()
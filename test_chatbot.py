@@ -2,6 +2,7 @@ import os
 import sys
 from dotenv import load_dotenv
 from openai import OpenAI
+from database import DEFAULT_SYSTEM_PROMPT
 
 def test_openai_connection():
     """Prueba la conexión con OpenAI"""
@@ -50,7 +51,7 @@ def test_chatbot_functionality():
     ]
     
     mensajes = [
-        {"role": "system", "content": "Eres un asistente relajado y divertido."}
+        {"role": "system", "content": DEFAULT_SYSTEM_PROMPT}
     ]
     
     for i, test_msg in enumerate(test_messages, 1):
@@ -102,7 +103,7 @@ def run_interactive_test():
     
     client = OpenAI(api_key=api_key)
     mensajes = [
-        {"role": "system", "content": "Eres un asistente relajado y divertido."}
+        {"role": "system", "content": DEFAULT_SYSTEM_PROMPT}
     ]
     
     print("💬 Escribe hasta 3 mensajes para probar el chatbot (escribe 'salir' para terminar antes)")
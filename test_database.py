@@ -1,6 +1,8 @@
 import os
 import sys
+import sqlite3
 from database import DatabaseManager
+from migrations import LATEST_VERSION, apply_migrations, get_schema_version
 import uuid
 
 def test_database():
@@ -94,7 +96,8 @@ def test_performance():
     print("\n⚡ PRUEBA DE RENDIMIENTO")
     print("=" * 30)
     
-    db = DatabaseManager("perf_test.db")
+    # Motor en memoria: mide la lógica sin el coste de fsync del disco
+    db = DatabaseManager("memory://perf_test")
     session_id = str(uuid.uuid4())
     db.create_session(session_id)
     
@@ -115,15 +118,297 @@ def test_performance():
     read_time = time.time() - start_time
     print(f"✅ Lectura de {len(history)} mensajes: {read_time:.3f} segundos")
     
-    # Limpiar
+    # La ventana de contexto conserva el sistema y los mensajes más recientes
+    openai_messages = db.get_openai_messages(session_id)
+    assert openai_messages[0]['role'] == 'system'
+    assert len(openai_messages) == 21
+    assert openai_messages[-1]['content'] == "Respuesta de prueba 99"
+    print(f"✅ Ventana de contexto: {len(openai_messages)} mensajes")
+    
+    # El historial se pagina desde el final hasta recuperar la sesión completa
+    page = db.get_history_page(session_id, limit=150)
+    assert page['total'] == 200 and page['start'] == 50
+    assert page['messages'][-1]['content'] == "Respuesta de prueba 99"
+    restored = page['messages']
+    while page['start'] > 0:
+        page = db.get_history_page(session_id, limit=150, before=page['start'])
+        restored = page['messages'] + restored
+    assert len(restored) == 200 and restored[0]['content'] == "Mensaje de prueba 0"
+    print(f"✅ Historial paginado: {len(restored)} mensajes")
+    
+    db.engine.close()
+
+def test_memory_engine():
+    """Prueba del motor en memoria compartido"""
+    print("\n🧠 PRUEBA DE MOTOR EN MEMORIA")
+    print("=" * 30)
+    
+    db = DatabaseManager("memory://engine_test")
+    try:
+        session_id = str(uuid.uuid4())
+        db.create_session(session_id, "MemoryUser")
+        db.add_message(session_id, "user", "Hola")
+        db.add_message(session_id, "assistant", "¡Hola!", 10)
+        
+        # Otra instancia con el mismo nombre ve los mismos datos
+        other = DatabaseManager("memory://engine_test")
+        assert other.get_session_stats(session_id)['total_tokens'] == 10
+        assert len(other.get_conversation_history(session_id)) == 3
+        print("✅ Datos compartidos entre instancias")
+        
+        # El backup vuelca la base en memoria a un archivo SQLite normal
+        assert db.backup_database("memory_backup.db")
+        restored = DatabaseManager("memory_backup.db")
+        assert len(restored.get_conversation_history(session_id)) == 3
+        print("✅ Backup de memoria a archivo")
+        
+        # La caché de plantillas se separa por base de datos concreta
+        assert other.engine.identity == db.engine.identity
+        assert restored.engine.identity == "sqlite:" + os.path.abspath("memory_backup.db")
+        anonymous = [DatabaseManager(":memory:") for _ in range(2)]
+        assert anonymous[0].engine.identity != anonymous[1].engine.identity
+        for instance in anonymous:
+            instance.engine.close()
+        print("✅ Espacio de nombres de caché único por base de datos")
+    finally:
+        db.engine.close()
+        try:
+            os.remove("memory_backup.db")
+        except:
+            pass
+
+def test_migrations():
+    """Prueba de las migraciones versionadas del esquema"""
+    print("\n🧱 PRUEBA DE MIGRACIONES")
+    print("=" * 30)
+    
+    # Base de datos anterior a las migraciones (user_version = 0) con datos
+    conn = sqlite3.connect("legacy_test.db")
+    conn.execute('''
+        CREATE TABLE sessions (
+            id TEXT PRIMARY KEY,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            last_activity TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            user_name TEXT,
+            session_data TEXT
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE messages (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            session_id TEXT,
+            role TEXT CHECK(role IN ('system', 'user', 'assistant')),
+            content TEXT NOT NULL,
+            timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            tokens_used INTEGER DEFAULT 0,
+            FOREIGN KEY (session_id) REFERENCES sessions (id)
+        )
+    ''')
+    for session_id, prompt in (('legacy', 'Prompt antiguo'), ('legacy2', 'Prompt antiguo'),
+                               ('legacy3', 'Prompt revisado')):
+        conn.execute("INSERT INTO sessions (id, user_name) VALUES (?, 'Legacy')", (session_id,))
+        conn.execute("INSERT INTO messages (session_id, role, content) VALUES (?, 'system', ?)",
+                     (session_id, prompt))
+        conn.execute("INSERT INTO messages (session_id, role, content) VALUES (?, 'user', 'Hola')",
+                     (session_id,))
+    conn.commit()
+    conn.close()
+    
+    try:
+        db = DatabaseManager("legacy_test.db")
+        conn = db._connect()
+        assert get_schema_version(conn) == LATEST_VERSION
+        conn.close()
+        assert {s['session_id'] for s in db.get_all_sessions()} == {'legacy', 'legacy2', 'legacy3'}
+        print(f"✅ Esquema migrado a v{LATEST_VERSION} conservando los datos")
+        
+        # Los prompts del sistema duplicados se colapsan en una plantilla por contenido,
+        # numeradas 1, 2, ... en orden de aparición
+        conn = db._connect()
+        assert conn.execute("SELECT content, version FROM prompt_templates ORDER BY version").fetchall() == [
+            ('Prompt antiguo', 1), ('Prompt revisado', 2)
+        ]
+        assert conn.execute("SELECT COUNT(*) FROM messages WHERE role = 'system'").fetchone()[0] == 0
+        conn.close()
+        assert db.get_openai_messages('legacy') == [
+            {'role': 'system', 'content': 'Prompt antiguo'},
+            {'role': 'user', 'content': 'Hola'}
+        ]
+        print("✅ Prompts del sistema deduplicados")
+        
+        # Con el esquema al día no se ejecuta DDL
+        statements = []
+        conn = db._connect()
+        conn.set_trace_callback(statements.append)
+        assert apply_migrations(conn) == []
+        conn.close()
+        assert not any('CREATE' in sql for sql in statements)
+        print("✅ Sin DDL cuando el esquema está al día")
+    finally:
+        try:
+            os.remove("legacy_test.db")
+        except:
+            pass
+
+def test_archive():
+    """Prueba del almacenamiento frío comprimido"""
+    print("\n🧊 PRUEBA DE ARCHIVO COMPRIMIDO")
+    print("=" * 30)
+    
+    db = DatabaseManager("memory://archive_test")
+    session_id = str(uuid.uuid4())
+    db.create_session(session_id, "ArchiveUser")
+    for i in range(20):
+        db.add_message(session_id, "user", f"Mensaje de prueba {i}")
+        db.add_message(session_id, "assistant", f"Respuesta de prueba {i}", 20)
+    
+    history_before = db.get_conversation_history(session_id, limit=100)
+    stats_before = db.get_session_stats(session_id)
+    
     try:
-        os.remove("perf_test.db")
-    except:
-        pass
+        # idle_days negativo para que la sesión recién creada cuente como inactiva
+        result = db.archive_idle_sessions(idle_days=-1, dictionary=db.build_archive_dictionary())
+        assert result['sessions'] == 1
+        assert result['compressed_bytes'] < result['raw_bytes']
+        print(f"✅ Archivado: {result['raw_bytes']} → {result['compressed_bytes']} bytes")
+        
+        # La lectura es transparente entre ambos niveles
+        assert db.get_conversation_history(session_id, limit=100) == history_before
+        assert db.get_session_stats(session_id)['total_tokens'] == stats_before['total_tokens']
+        
+        # Un run sin sesiones inactivas no guarda otro diccionario
+        db.archive_idle_sessions(idle_days=-1, dictionary=db.build_archive_dictionary())
+        conn = db._connect()
+        assert conn.execute('SELECT COUNT(*) FROM archive_dictionaries').fetchone()[0] == 1
+        conn.close()
+        
+        # Reanudar la sesión la devuelve a la tabla activa en orden
+        db.add_message(session_id, "user", "Mensaje después de archivar")
+        history = db.get_conversation_history(session_id, limit=100)
+        assert len(history) == len(history_before) + 1
+        assert history[-1]['content'] == "Mensaje después de archivar"
+        assert db.get_archive_stats()['archived_sessions'] == 0
+        messages = db.get_openai_messages(session_id)
+        assert messages[0]['role'] == 'system'
+        assert messages[-1]['content'] == "Mensaje después de archivar"
+        assert messages[-2]['content'] == "Respuesta de prueba 19"
+        print(f"✅ Sesión reanudada desde el archivo: {len(history)} mensajes")
+        
+        # Al no quedar bloques que lo usen, el diccionario se poda
+        db.archive_idle_sessions(idle_days=1)
+        conn = db._connect()
+        assert conn.execute('SELECT COUNT(*) FROM archive_dictionaries').fetchone()[0] == 0
+        conn.close()
+        
+        # Limpiar la sesión conserva el mensaje del sistema
+        db.clear_session(session_id)
+        history = db.get_conversation_history(session_id)
+        assert [msg['role'] for msg in history] == ['system']
+        print("✅ Sesión limpiada correctamente")
+    finally:
+        db.engine.close()
+
+def test_lock_wait_metrics():
+    """Las esperas por bloqueo que terminan bien también llegan a /metrics"""
+    print("\n🔒 PRUEBA DE MÉTRICAS DE BLOQUEO")
+    print("=" * 30)
+    
+    import threading
+    import time
+    from metrics import DB_BUSY, DB_LOCK_WAIT_SECONDS
+    
+    db = DatabaseManager("memory://lock_test")
+    session_id = str(uuid.uuid4())
+    db.create_session(session_id)
+    acquired_before = DB_BUSY._values.get(("execute", "acquired"), 0)
+    
+    # Otra conexión mantiene la escritura abierta 0.2 s
+    writer = db._connect()
+    writer.execute("UPDATE sessions SET user_name = 'bloqueo' WHERE id = ?", (session_id,))
+    release = threading.Timer(0.2, writer.commit)
+    release.start()
+    try:
+        assert db.add_message(session_id, "user", "Mensaje tras esperar el bloqueo")
+        assert DB_BUSY._values.get(("execute", "acquired"), 0) == acquired_before + 1
+        waits = DB_LOCK_WAIT_SECONDS._series[()]
+        assert waits[1] >= 0.15
+        print(f"✅ Espera por bloqueo registrada: {waits[1]:.3f} s acumulados")
+    finally:
+        release.join()
+        writer.close()
+        db.engine.close()
+
+def test_worker_metrics():
+    """/metrics suma los registros de todos los workers, también de los ya reciclados"""
+    print("\n👷 PRUEBA DE MÉTRICAS ENTRE WORKERS")
+    print("=" * 30)
+    
+    import json
+    import tempfile
+    import metrics
+    
+    def worker_snapshot(busy, wait):
+        return {"chatbot_db_busy_total": [[["execute", "acquired"], busy]],
+                "chatbot_db_lock_wait_seconds": [[[], [[0] * len(metrics.DB_LOCK_WAIT_SECONDS.buckets) + [1], wait]]]}
+    
+    with tempfile.TemporaryDirectory() as metrics_dir:
+        for pid, busy in ((1001, 2), (1002, 3)):
+            with open(os.path.join(metrics_dir, f"worker_{pid}.json"), "w") as f:
+                json.dump(worker_snapshot(busy, 40.0), f)
+        # El worker 1001 se recicla: sus contadores pasan al acumulado de workers terminados
+        metrics.retire_worker(metrics_dir, 1001)
+        assert not os.path.exists(os.path.join(metrics_dir, "worker_1001.json"))
+        
+        previous_dir = metrics.METRICS_DIR
+        metrics.METRICS_DIR = metrics_dir
+        try:
+            own = metrics.DB_BUSY.snapshot().get(("execute", "acquired"), 0)
+            text = metrics.render_metrics()
+        finally:
+            metrics.METRICS_DIR = previous_dir
+            os.remove(os.path.join(metrics_dir, f"worker_{os.getpid()}.json"))
+        
+        assert f'chatbot_db_busy_total{{operation="execute",outcome="acquired"}} {own + 5}' in text
+        assert 'chatbot_db_lock_wait_seconds_bucket{le="+Inf"}' in text
+        assert "chatbot_db_lock_wait_seconds_sum " in text
+        print("✅ Contadores e histogramas sumados entre workers")
+
+def test_usage_rollups():
+    """Prueba de los rollups de uso mantenidos al escribir"""
+    print("\n📈 PRUEBA DE ROLLUPS DE USO")
+    print("=" * 30)
+    
+    db = DatabaseManager("memory://rollup_test")
+    try:
+        for session_id in ("s1", "s2"):
+            db.create_session(session_id)
+            db.add_message(session_id, "user", "Hola")
+            db.add_message(session_id, "assistant", "¡Hola!", 20, latency=0.8)
+        db.add_message("s1", "user", "¿Qué tal?")
+        
+        for period in ("hourly", "daily"):
+            rollups = db.get_usage_rollups(period, "0000", "9999")
+            assert len(rollups['rows']) == 1
+            _, messages, user_messages, bot_messages, tokens, sessions, latency_count, _ = rollups['rows'][0]
+            assert (messages, user_messages, bot_messages, tokens, sessions, latency_count) == (5, 3, 2, 40, 2, 2)
+            assert sum(row[2] for row in rollups['latency_rows']) == 2
+        print("✅ Rollups horarios y diarios actualizados en cada escritura")
+        
+        assert db.compact_usage_rollups()
+        assert len(db.get_usage_rollups("hourly", "0000", "9999")['rows']) == 1
+        print("✅ Compactación conserva el bucket en curso")
+    finally:
+        db.engine.close()
 
 if __name__ == "__main__":
     test_database()
     test_performance()
+    test_memory_engine()
+    test_migrations()
+    test_archive()
+    test_lock_wait_metrics()
+    test_worker_metrics()
+    test_usage_rollups()
     
     print("\n🚀 ¿Quieres probar la aplicación web con persistencia?")
     print("Ejecuta: python app.py")
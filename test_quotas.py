@@ -0,0 +1,97 @@
+from database import DatabaseManager
+from quotas import QuotaManager, SlidingWindowCounter
+
+def test_sliding_window():
+    """Prueba del contador de ventana deslizante"""
+    print("\n⏱️ PRUEBA DE VENTANA DESLIZANTE")
+    print("=" * 30)
+    
+    counter = SlidingWindowCounter(window_seconds=60, buckets=6)
+    counter.add(100, now=0)
+    counter.add(50, now=25)
+    assert counter.value(now=30) == 150
+    
+    # A los 60 s sale el primer bucket; a los 90 s también el segundo
+    assert counter.value(now=61) == 50
+    assert counter.value(now=95) == 0
+    print("✅ Los tokens antiguos salen de la ventana")
+
+def test_quota_manager():
+    """Prueba de rechazo, degradación y persistencia de cuotas"""
+    print("\n🎟️ PRUEBA DE CUOTAS")
+    print("=" * 30)
+    
+    db = DatabaseManager("memory://quota_test")
+    try:
+        quotas = QuotaManager(db, session_limit=1000, user_limit=1500, window_seconds=3600,
+                              flush_interval=3600)
+        now = 1_000_000
+        
+        assert quotas.check("s1", "ana", max_tokens=500, now=now)['allowed']
+        quotas.record("s1", "ana", 700, now=now)
+        
+        # Quedan 300 tokens de sesión: se acota max_tokens
+        decision = quotas.check("s1", "ana", max_tokens=500, now=now)
+        assert decision['degraded'] and decision['max_tokens'] == 300
+        print("✅ Respuesta degradada cerca del límite")
+        
+        quotas.record("s1", "ana", 300, now=now)
+        decision = quotas.check("s1", "ana", now=now)
+        assert not decision['allowed'] and decision['scope'] == 'session'
+        assert 0 < decision['retry_after'] <= 3600
+        print(f"✅ Sesión rechazada (reintentar en {decision['retry_after']:.0f} s)")
+        
+        # Otra sesión del mismo usuario solo tiene la cuota de usuario restante
+        decision = quotas.check("s2", "ana", max_tokens=1000, now=now)
+        assert decision['scope'] == 'user' and decision['max_tokens'] == 500
+        
+        # Los contadores sobreviven al volcado y a un nuevo proceso
+        quotas.flush(now=now)
+        restored = QuotaManager(db, session_limit=1000, user_limit=1500, window_seconds=3600)
+        restored.reload(now=now)
+        assert not restored.check("s1", "ana", now=now)['allowed']
+        assert restored.check("s1", "ana", now=now + 3600)['allowed']
+        print("✅ Contadores persistidos en SQLite")
+        
+        # El prompt estimado también se descuenta de lo que queda
+        decision = quotas.check("s3", "ben", max_tokens=500, prompt_tokens=800, now=now)
+        assert decision['degraded'] and decision['max_tokens'] == 200
+        assert not quotas.check("s3", "ben", prompt_tokens=1000, now=now)['allowed']
+        print("✅ El prompt cuenta para la cuota")
+        
+        # Al volcar se podan los buckets que salieron de la ventana
+        quotas.record("s4", None, 50, now=now + 7200)
+        quotas.flush(now=now + 7200)
+        assert {row[2] for row in db.get_token_usage(0)} == {int(now + 7200) // 60 * 60}
+        print("✅ Buckets antiguos podados de token_usage")
+    finally:
+        db.engine.close()
+
+def test_background_flush():
+    """El volcado periódico corre en un hilo aparte, no en record()"""
+    print("\n🧵 PRUEBA DE VOLCADO EN SEGUNDO PLANO")
+    print("=" * 30)
+    
+    import time
+    db = DatabaseManager("memory://quota_flush_test")
+    try:
+        quotas = QuotaManager(db, session_limit=1000, window_seconds=3600, flush_interval=0.2)
+        quotas.start_background_flush()
+        # Aunque toque volcar, record() lo deja al hilo
+        quotas._last_flush = 0
+        quotas.record("s1", None, 100)
+        assert quotas._pending
+        
+        deadline = time.time() + 2
+        while not db.get_token_usage(0) and time.time() < deadline:
+            time.sleep(0.01)
+        assert sum(row[3] for row in db.get_token_usage(0)) == 100
+        quotas.stop_background_flush()
+        print("✅ Tokens volcados por el hilo de segundo plano")
+    finally:
+        db.engine.close()
+
+if __name__ == "__main__":
+    test_sliding_window()
+    test_quota_manager()
+    test_background_flush()
@@ -0,0 +1,84 @@
+import json
+import os
+import time
+from database import DatabaseManager
+from mock_provider import MockOpenAIClient
+from routing import COMPLEX, GENERAL, SMALL_TALK, ModelRouter, classify_message
+
+def test_classifier():
+    """Prueba del clasificador local de mensajes"""
+    print("\n🏷️ PRUEBA DEL CLASIFICADOR")
+    print("=" * 30)
+    
+    assert classify_message("¡Hola! ¿Qué tal?") == SMALL_TALK
+    assert classify_message("gracias") == SMALL_TALK
+    assert classify_message("¿Cuál es la capital de Francia?") == GENERAL
+    assert classify_message("Explícame paso a paso cómo funciona un índice B-tree") == COMPLEX
+    assert classify_message("Tengo este error:\n```\nTraceback ...```") == COMPLEX
+    
+    # Un mensaje largo en una conversación profunda pasa a complex
+    long_message = "Cuéntame más sobre la historia de Roma " * 6
+    assert classify_message(long_message, depth=5) == GENERAL
+    assert classify_message(long_message, depth=40) == COMPLEX
+    print("✅ Categorías correctas")
+
+def test_adaptive_routing():
+    """El enrutador aprende a mandar la charla trivial a la ruta más rápida y barata"""
+    print("\n🧭 PRUEBA DE ENRUTADO ADAPTATIVO")
+    print("=" * 30)
+    
+    db = DatabaseManager("memory://routing_test")
+    try:
+        client = MockOpenAIClient(latencies={"gpt-4o-mini": 0.001, "gpt-3.5-turbo": 0.02})
+        router = ModelRouter(db, epsilon=0)
+        
+        for _ in range(10):
+            route = router.route("hola", depth=1)
+            start = time.perf_counter()
+            response = client.chat.completions.create(
+                model=route['model'],
+                messages=[{"role": "user", "content": "hola"}],
+                max_tokens=route['max_tokens']
+            )
+            router.record(route, time.perf_counter() - start, response.usage.total_tokens)
+        
+        # Tras explorar ambas rutas, se queda con la más rápida y barata
+        assert router.route("hola")['route'] == "fast"
+        assert [call['model'] for call in client.calls[-3:]] == ["gpt-4o-mini"] * 3
+        print("✅ Charla trivial enrutada a la ruta rápida")
+        
+        # Las estadísticas quedan en la base de datos y otro proceso las recupera
+        restored = ModelRouter(db, epsilon=0)
+        stats = {(s['route'], s['category']): s for s in db.get_route_stats()}
+        assert sum(s['requests'] for s in stats.values()) == 10
+        assert restored.route("hola")['route'] == "fast"
+        print("✅ Estadísticas de rutas persistidas")
+    finally:
+        db.engine.close()
+
+def test_routing_config():
+    """Una ROUTING_CONFIG sin rutas para alguna categoría falla al crear el enrutador"""
+    print("\n⚙️ PRUEBA DE ROUTING_CONFIG")
+    print("=" * 30)
+    
+    routes = {"unica": {"model": "gpt-4o-mini", "max_tokens": 300, "cost_per_1k_tokens": 0.0006}}
+    try:
+        # Rutas propias sin categorías: las categorías por defecto no encuentran ninguna
+        os.environ["ROUTING_CONFIG"] = json.dumps({"routes": routes})
+        try:
+            ModelRouter.from_env()
+            assert False, "se esperaba ValueError"
+        except ValueError:
+            pass
+        
+        categories = {SMALL_TALK: ["unica"], GENERAL: ["unica"], COMPLEX: ["unica"]}
+        os.environ["ROUTING_CONFIG"] = json.dumps({"routes": routes, "categories": categories})
+        assert ModelRouter.from_env().route("hola")['route'] == "unica"
+    finally:
+        del os.environ["ROUTING_CONFIG"]
+    print("✅ Configuración incompleta rechazada al arrancar")
+
+if __name__ == "__main__":
+    test_classifier()
+    test_adaptive_routing()
+    test_routing_config()
@@ -0,0 +1,77 @@
+from datetime import datetime, timedelta
+from database import DatabaseManager, latency_bucket
+from usage import build_usage_series, get_usage, parse_utc, utc_now
+
+def test_usage_series():
+    """Prueba de la serie de uso servida desde los rollups"""
+    print("\n📊 PRUEBA DE SERIE DE USO")
+    print("=" * 30)
+    
+    db = DatabaseManager("memory://usage_test")
+    try:
+        db.create_session("s1")
+        db.add_message("s1", "user", "Hola")
+        db.add_message("s1", "assistant", "¡Hola!", 30, latency=0.4)
+        
+        now = utc_now()
+        usage = get_usage(db, now - timedelta(hours=24), now)
+        assert usage['period'] == 'hourly'
+        assert usage['totals']['messages'] == 2 and usage['totals']['tokens'] == 30
+        assert usage['series'][-1]['messages'] == 2
+        assert usage['totals']['latency_p50'] == 0.5
+        
+        usage = get_usage(db, now - timedelta(days=30), now)
+        assert usage['period'] == 'daily' and usage['totals']['messages'] == 2
+        print("✅ Serie horaria y diaria correctas")
+        
+        # Fechas con zona se normalizan a UTC sin zona
+        assert parse_utc("2024-05-01T12:00:00Z") == datetime(2024, 5, 1, 12)
+        assert parse_utc("2024-05-01T14:00:00+02:00") == datetime(2024, 5, 1, 12)
+        assert parse_utc("2024-05-01T12:00:00") == datetime(2024, 5, 1, 12)
+        print("✅ Fechas normalizadas a UTC")
+    finally:
+        db.engine.close()
+
+def test_downsampling_and_percentiles():
+    """Reducción de puntos y percentiles vectorizados"""
+    print("\n🧮 PRUEBA DE AGREGACIÓN")
+    print("=" * 30)
+    
+    # 48 horas con 10 mensajes por hora; latencias: 90 rápidas y 10 lentas por hora
+    start = datetime(2026, 1, 1)
+    rows = []
+    latency_rows = []
+    for hour in range(48):
+        bucket = (start + timedelta(hours=hour)).strftime('%Y-%m-%d %H:%M:%S')
+        rows.append((bucket, 10, 5, 5, 100, hour % 4, 100, 100 * 0.3))
+        latency_rows.append((bucket, latency_bucket(0.2), 90))
+        latency_rows.append((bucket, latency_bucket(5.0), 10))
+    
+    usage = build_usage_series({'rows': rows, 'latency_rows': latency_rows}, 'hourly',
+                               '2026-01-01 00:00:00', '2026-01-03 00:00:00', max_points=12)
+    
+    assert len(usage['series']) == 12
+    assert usage['bucket_seconds'] == 4 * 3600
+    assert all(point['messages'] == 40 for point in usage['series'])
+    assert all(point['active_sessions'] == 3 for point in usage['series'])  # pico, no suma
+    assert usage['totals']['messages'] == 480
+    assert usage['totals']['latency_p50'] == 0.25
+    assert usage['totals']['latency_p95'] == 6.0
+    print(f"✅ {len(usage['series'])} puntos, p50={usage['totals']['latency_p50']}s, "
+          f"p95={usage['totals']['latency_p95']}s")
+    
+    # Rango enorme por horas: las filas se suman en los puntos de salida sin serie densa
+    usage = build_usage_series({'rows': rows, 'latency_rows': latency_rows}, 'hourly',
+                               '0001-01-01 00:00:00', '9999-01-01 00:00:00', max_points=0)
+    assert len(usage['series']) == 1
+    assert usage['totals']['messages'] == 480
+    assert usage['totals']['peak_active_sessions'] == 3
+    usage = build_usage_series({'rows': rows, 'latency_rows': latency_rows}, 'hourly',
+                               '2000-01-01 00:00:00', '9999-01-01 00:00:00', max_points=10 ** 6)
+    assert len(usage['series']) <= 2000
+    assert sum(point['messages'] for point in usage['series']) == 480
+    print("✅ Rangos enormes acotados a los puntos pedidos")
+
+if __name__ == "__main__":
+    test_usage_series()
+    test_downsampling_and_percentiles()
@@ -0,0 +1,169 @@
+"""
+Series temporales de uso a partir de los rollups por hora y por día
+La agregación (reducción de puntos y percentiles de latencia) está vectorizada con NumPy
+"""
+
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List
+
+import numpy as np
+
+from database import LATENCY_BUCKETS
+
+PERIOD_STEPS = {
+    'hourly': np.timedelta64(1, 'h'),
+    'daily': np.timedelta64(1, 'D')
+}
+PERCENTILES = (50, 95, 99)
+# Puntos máximos por respuesta de /usage
+MAX_POINTS = 2000
+BUCKET_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+# Límite superior de cada bucket de latencia; el desbordamiento se reporta como el último límite
+_LATENCY_EDGES = np.array(LATENCY_BUCKETS + (LATENCY_BUCKETS[-1],), dtype=float)
+
+
+def parse_utc(value: str) -> datetime:
+    """Fecha ISO 8601 como datetime UTC sin zona (las fechas sin zona ya se asumen UTC)"""
+    if value.endswith(('Z', 'z')):
+        value = value[:-1] + '+00:00'
+    moment = datetime.fromisoformat(value)
+    if moment.tzinfo is not None:
+        moment = moment.astimezone(timezone.utc).replace(tzinfo=None)
+    return moment
+
+
+def utc_now() -> datetime:
+    """Instante actual en UTC sin zona, como los buckets de los rollups"""
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def choose_period(start: datetime, end: datetime) -> str:
+    """Rollup horario hasta 7 días de rango, diario a partir de ahí"""
+    return 'hourly' if end - start <= timedelta(days=7) else 'daily'
+
+
+def _floor(moment: datetime, period: str) -> datetime:
+    moment = moment.replace(minute=0, second=0, microsecond=0)
+    return moment.replace(hour=0) if period == 'daily' else moment
+
+
+def bucket_range(start: datetime, end: datetime, period: str):
+    """Límites [inicio, fin) alineados a los buckets del periodo, como texto de SQLite"""
+    start = _floor(start, period)
+    end_floor = _floor(end, period)
+    if end_floor < end:
+        end_floor += timedelta(days=1) if period == 'daily' else timedelta(hours=1)
+    return start.strftime(BUCKET_FORMAT), end_floor.strftime(BUCKET_FORMAT)
+
+
+def _percentiles(histograms: np.ndarray) -> Dict[int, np.ndarray]:
+    """Percentiles por fila de una matriz [puntos x buckets de latencia] (NaN si vacía)"""
+    cumulative = histograms.cumsum(axis=1)
+    totals = cumulative[:, -1]
+    result = {}
+    for q in PERCENTILES:
+        target = totals * (q / 100.0)
+        index = (cumulative >= target[:, None]).argmax(axis=1)
+        values = _LATENCY_EDGES[index]
+        result[q] = np.where(totals > 0, values, np.nan)
+    return result
+
+
+def _to_list(values: np.ndarray, digits: int = 4) -> List:
+    return [None if np.isnan(value) else round(float(value), digits) for value in values]
+
+
+def build_usage_series(rollups: Dict, period: str, start: str, end: str, max_points: int = 200) -> Dict:
+    """Convierte filas de rollups en una serie de como mucho max_points puntos
+
+    Las filas (dispersas) se suman directamente en los puntos de salida: la
+    memoria depende de max_points y de las filas, no de la longitud del rango.
+    """
+    step = PERIOD_STEPS[period]
+    origin = np.datetime64(start.replace(' ', 'T'), 's')
+    n = max(int((np.datetime64(end.replace(' ', 'T'), 's') - origin) // step), 0)
+    columns = ('messages', 'user_messages', 'assistant_messages', 'tokens',
+               'active_sessions', 'latency_count', 'latency_sum')
+    sessions_column = columns.index('active_sessions')
+
+    # Agrupar buckets consecutivos (sumas; sesiones activas como pico)
+    max_points = min(max(max_points, 1), MAX_POINTS)
+    factor = max(-(-n // max_points), 1)
+    points = -(-n // factor)
+    sums = np.zeros((points, len(columns)), dtype=float)
+    peak_sessions = np.zeros(points, dtype=float)
+    histograms = np.zeros((points, len(LATENCY_BUCKETS) + 1), dtype=float)
+
+    rows = rollups['rows']
+    if rows and n:
+        times = np.array([row[0] for row in rows], dtype='datetime64[s]')
+        index = ((times - origin) // step).astype(np.int64)
+        values = np.array([row[1:] for row in rows], dtype=float)
+        valid = (index >= 0) & (index < n)
+        index, values = index[valid], values[valid]
+        np.add.at(sums, index // factor, values)
+        # El pico se toma por bucket del rollup (sumando filas repetidas del mismo bucket)
+        buckets, inverse = np.unique(index, return_inverse=True)
+        bucket_sessions = np.zeros(len(buckets), dtype=float)
+        np.add.at(bucket_sessions, inverse, values[:, sessions_column])
+        np.maximum.at(peak_sessions, buckets // factor, bucket_sessions)
+
+    latency_rows = rollups['latency_rows']
+    if latency_rows and n:
+        times = np.array([row[0] for row in latency_rows], dtype='datetime64[s]')
+        index = ((times - origin) // step).astype(np.int64)
+        buckets = np.array([row[1] for row in latency_rows], dtype=int)
+        counts = np.array([row[2] for row in latency_rows], dtype=float)
+        valid = (index >= 0) & (index < n)
+        np.add.at(histograms, (index[valid] // factor, buckets[valid]), counts[valid])
+
+    latency_count = sums[:, columns.index('latency_count')]
+    latency_sum = sums[:, columns.index('latency_sum')]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        latency_avg = np.where(latency_count > 0, latency_sum / latency_count, np.nan)
+    percentiles = _percentiles(histograms)
+
+    starts = origin + np.arange(points) * factor * step
+    series = []
+    for i in range(points):
+        series.append({
+            'start': str(starts[i]).replace('T', ' '),
+            'messages': int(sums[i, 0]),
+            'user_messages': int(sums[i, 1]),
+            'assistant_messages': int(sums[i, 2]),
+            'tokens': int(sums[i, 3]),
+            'active_sessions': int(peak_sessions[i]),
+        })
+    for key, values in [('latency_avg', latency_avg)] + [(f'latency_p{q}', percentiles[q]) for q in PERCENTILES]:
+        for point, value in zip(series, _to_list(values)):
+            point[key] = value
+
+    total_percentiles = _percentiles(histograms.sum(axis=0, keepdims=True))
+    total_latency_count = latency_count.sum()
+    totals = {
+        'messages': int(sums[:, 0].sum()),
+        'tokens': int(sums[:, 3].sum()),
+        'peak_active_sessions': int(peak_sessions.max()) if points else 0,
+        'latency_avg': (round(float(latency_sum.sum() / total_latency_count), 4)
+                        if total_latency_count else None),
+    }
+    for q in PERCENTILES:
+        totals[f'latency_p{q}'] = _to_list(total_percentiles[q])[0]
+
+    return {
+        'period': period,
+        'bucket_seconds': int(step / np.timedelta64(1, 's')) * factor,
+        'start': start,
+        'end': end,
+        'series': series,
+        'totals': totals
+    }
+
+
+def get_usage(db, start: datetime, end: datetime, period: str = None, max_points: int = 200) -> Dict:
+    """Serie de uso para [start, end) leída de los rollups (nunca de la tabla messages)"""
+    period = period or choose_period(start, end)
+    start_text, end_text = bucket_range(start, end, period)
+    rollups = db.get_usage_rollups(period, start_text, end_text)
+    return build_usage_series(rollups, period, start_text, end_text, max_points)